@@ -23,12 +23,20 @@
 #FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 #OTHER DEALINGS IN THE SOFTWARE.
 
-__init__ = ['user_shell_folders', 'get_shell_dir', 'parse_dest_dirs']
+from __future__ import with_statement
+
+__init__ = ['user_shell_folders', 'xdg_user_dirs', 'get_shell_dir', 'parse_dest_dirs']
 
 import os
-import _winreg
+import re
+try:
+    import _winreg
+except ImportError:
+    _winreg = None
 
 def user_shell_folders():
+    if _winreg is None:
+        return xdg_user_dirs()
     ret = {}
     key = hive = None
     try:
@@ -46,9 +54,33 @@ def user_shell_folders():
             _winreg.CloseKey(hive)
     return ret
 
-_user_shell_folders = user_shell_folders()
+XDG_DIR = re.compile(r'^XDG_(?P<name>[A-Z]+)_DIR="(?P<path>.*)"$')
+
+def xdg_user_dirs():
+    """ The folders a freedesktop session keeps pictures and so on in,
+        named as Windows names them
+    """
+    home = os.path.expanduser('~')
+    # What they are when user-dirs.dirs doesn't say
+    ret = {'Pictures': os.path.join(home, 'Pictures'), 'Desktop': os.path.join(home, 'Desktop')}
+    config = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+    try:
+        with open(os.path.join(config, 'user-dirs.dirs')) as f:
+            for line in f:
+                m = XDG_DIR.match(line.strip())
+                if m:
+                    ret[m.group('name').capitalize()] = m.group('path').replace('$HOME', home)
+    except IOError:
+        pass
+    return ret
+
+_user_shell_folders = None
 
 def get_shell_dir(d):
+    global _user_shell_folders
+    # Only look them up if a destination asks for one
+    if _user_shell_folders is None:
+        _user_shell_folders = user_shell_folders()
     ret = _user_shell_folders.get(d, None)
     if not ret: # Not sure we need this
         ret = _user_shell_folders.get("My %s" % (d,), None)
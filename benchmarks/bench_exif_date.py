@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Times the quick DateTimeOriginal reader against EXIF.process_file
+
+    python benchmarks/bench_exif_date.py [-r repeats] <jpeg>...
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import EXIF
+from exif_date import date_time_original, MalformedExif
+
+def quick(path):
+    with open(path, 'rb') as f:
+        try:
+            return date_time_original(f)
+        except MalformedExif:
+            return None
+
+def full(path):
+    with open(path, 'rb') as f:
+        tags = EXIF.process_file(f, stop_tag='DateTimeOriginal')
+    dto = tags.get('EXIF DateTimeOriginal')
+    return None if dto is None else str(dto)
+
+def timed(func, paths, repeats):
+    best = None
+    for i in range(repeats):
+        started = time.time()
+        for path in paths:
+            func(path)
+        took = time.time() - started
+        if best is None or took < best:
+            best = took
+    return best
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] <jpeg>...")
+    parser.add_option("-r", "--repeats", default=5, type="int",
+                      dest="repeats", help="Take the best of this many runs")
+    (options, paths) = parser.parse_args()
+    if not paths:
+        parser.error("No JPEGs to time")
+    disagree = [p for p in paths if quick(p) != full(p)]
+    for p in disagree:
+        print "Readers disagree on %s: %r vs %r" % (p, quick(p), full(p))
+    for (name, func) in (("EXIF.process_file", full), ("date_time_original", quick)):
+        took = timed(func, paths, options.repeats)
+        print "%-20s %8.1f us/file %10.0f files/s" % (name, 1e6 * took / len(paths), len(paths) / took if took else 0)
+
+if __name__ == "__main__":
+    main()
+
+#vim:sw=4:ts=4
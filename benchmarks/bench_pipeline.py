@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Runs each stage of an import over a fake camera card and reports how
+    fast it went, without a window or a real card
+
+    python benchmarks/bench_pipeline.py [options] [card]
+
+    The card is made afresh unless it already exists, and is thrown away
+    afterwards unless it was named. Numbers are with the card in the
+    page cache, having just been written. MB/s is of what each stage
+    really read, or for the copy, copied.
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idir import idirs
+import path_metadata
+import probe
+import copier
+from path_metadata import MediaMetadata
+from workers import WorkerPool
+from importer import Importer
+from corpus import Corpus
+
+class CountedFile(object):
+    """ A file that adds up what's read from it
+    """
+
+    def __init__(self, f, counter):
+        self.f = f
+        self.counter = counter
+
+    def read(self, *args):
+        buf = self.f.read(*args)
+        self.counter.add(len(buf))
+        return buf
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.close()
+
+class ReadCounter(object):
+    """ Counts the bytes the import's modules read from files, and the
+        kernel copies for them, while it's installed
+    """
+    MODULES = (path_metadata, probe, copier)
+
+    def __init__(self):
+        self.lock = Lock()
+        self.total = 0
+
+    def add(self, n):
+        if n:
+            with self.lock:
+                self.total += n
+
+    def open(self, *args):
+        return CountedFile(open(*args), self)
+
+    def kernel_copy(self, *args):
+        n = self.real_kernel_copy(*args)
+        self.add(n)
+        return n
+
+    def __enter__(self):
+        self.total = 0
+        for module in ReadCounter.MODULES:
+            module.open = self.open
+        self.real_kernel_copy = copier.kernel_copy
+        copier.kernel_copy = self.kernel_copy
+        return self
+
+    def __exit__(self, *exc_info):
+        for module in ReadCounter.MODULES:
+            del module.open
+        copier.kernel_copy = self.real_kernel_copy
+
+class Bench(object):
+
+    def __init__(self, card, dest, jobs = 1):
+        self.card = card
+        self.dest = dest
+        self.jobs = jobs
+        self.results = []
+
+    def stage(self, name, func, items):
+        """ Runs func over items, counting what it reads, and keeps what
+            it made of them
+        """
+        pool = WorkerPool(self.jobs)
+        with ReadCounter() as counter:
+            started = time.time()
+            out = list(pool.imap_unordered(func, items))
+            took = time.time() - started
+        self.results.append((name, len(out), counter.total, took))
+        return out
+
+    def run(self):
+        def path_of(item):
+            return item if isinstance(item, basestring) else item.path
+
+        started = time.time()
+        walked = list(idirs([self.card], None, Importer.skip_dirs))
+        self.results.append(("walk", len(walked), 0, time.time() - started))
+        media = [item for (item, keep) in self.stage("filter", MediaMetadata.has_media_suff, walked) if keep]
+        mds = [md for (item, md) in self.stage("metadata", MediaMetadata, media)]
+        self.stage("digest", lambda md: md.digest(), mds)
+        self.stage("date", lambda md: md.get_date(), mds)
+
+        def copy(md):
+            (year, month, day) = md.date
+            return md.copy_to(os.path.join(self.dest, '%02d' % (year,), '%02d_%02d_%02d' % (year, month, day)))
+        self.stage("copy", copy, mds)
+
+    def report(self):
+        print "%-10s %7s %9s %12s %9s" % ("stage", "files", "seconds", "files/s", "MB/s")
+        for (name, files, size, took) in self.results:
+            print "%-10s %7d %9.3f %12.0f %9s" % (name, files, took, files / took if took else 0,
+                                                ("%.1f" % (size / 1048576.0 / took,)) if size and took else "-")
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] [card]")
+    parser.add_option("-p", "--photos", default=200, type="int",
+                      dest="photos", help="How many photos to put on a new card")
+    parser.add_option("-m", "--movies", default=20, type="int",
+                      dest="videos", help="How many videos to put on a new card")
+    parser.add_option("-s", "--seed", default=1, type="int",
+                      dest="seed", help="Seed for making a new card")
+    parser.add_option("-j", "--jobs", default=1, type="int",
+                      dest="jobs", help="Threads to run each stage on")
+    (options, args) = parser.parse_args()
+    if len(args) > 1:
+        parser.error("Only one card at a time")
+    scratch = tempfile.mkdtemp(prefix='bench_pipeline')
+    try:
+        card = args[0] if args else os.path.join(scratch, 'card')
+        if not os.path.isdir(card):
+            (count, size) = Corpus(options.photos, options.videos, seed=options.seed).write(card)
+            print "Made %d media files, %.1f MB, in %s" % (count, size / 1048576.0, card)
+        dest = os.path.join(scratch, 'dest')
+        os.mkdir(dest)
+        bench = Bench(card, dest, options.jobs)
+        bench.run()
+        bench.report()
+    finally:
+        shutil.rmtree(scratch, True)
+
+if __name__ == "__main__":
+    main()
+
+#vim:sw=4:ts=4
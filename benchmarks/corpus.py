@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Makes a reproducible fake camera card to benchmark against
+
+    python benchmarks/corpus.py [options] <dir>
+"""
+
+import os
+import time
+import random
+import struct
+
+# Seconds between the QuickTime epoch (1904) and the Unix one
+EPOCH_1904 = 2082844800
+# Directories a real card has that the importer skips
+SKIPPED = ['Originals', 'Thumb', '.thumbnails']
+
+def padding(n, size, block):
+    # Starts with the file's number, so no two files' samples match
+    out = ['%08d' % (n,)]
+    left = size - len(out[0])
+    rot = n % len(block)
+    block = block[rot:] + block[:rot]
+    while left > 0:
+        out.append(block[:left])
+        left -= len(out[-1])
+    return ''.join(out)
+
+def exif_jpeg(when, body):
+    """ A JPEG that's nothing but an Exif APP1 holding DateTimeOriginal,
+        and body where the scan would be
+    """
+    dto = time.strftime('%Y:%m:%d %H:%M:%S', when) + '\0'
+    # TIFF header, then IFD0 pointing at the Exif IFD, then the Exif IFD, then the date
+    exif_ifd = 8 + 2 + 12 + 4
+    dto_at = exif_ifd + 2 + 12 + 4
+    tiff = 'II' + struct.pack('<HI', 42, 8)
+    tiff += struct.pack('<HHHII', 1, 0x8769, 4, 1, exif_ifd) + struct.pack('<I', 0)
+    tiff += struct.pack('<HHHII', 1, 0x9003, 2, len(dto), dto_at) + struct.pack('<I', 0)
+    tiff += dto
+    app1 = 'Exif\0\0' + tiff
+    return ('\xff\xd8' + '\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            '\xff\xda' + struct.pack('>H', 2) + body + '\xff\xd9')
+
+def atom(kind, data):
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+def quicktime(when, body):
+    """ A QuickTime file whose mvhd says when it was made, with body as its media
+    """
+    created = int(time.mktime(when)) + EPOCH_1904
+    mvhd = atom('mvhd', struct.pack('>B3xII', 0, created, created) + '\0' * 88)
+    # Cameras write the movie header after the media, so do the same
+    return atom('ftyp', 'qt  \0\0\0\0') + atom('mdat', body) + atom('moov', mvhd)
+
+class Corpus(object):
+    """ The same seed always makes the same card
+    """
+
+    def __init__(self, photos = 200, videos = 20, photo_size = 512 * 1024, video_size = 4 * 1024 * 1024, seed = 1):
+        self.photos = photos
+        self.videos = videos
+        self.photo_size = photo_size
+        self.video_size = video_size
+        self.seed = seed
+
+    def write(self, top):
+        """ Fills top with a DCIM tree, returning how many media files and
+            bytes the importer should find in it
+        """
+        rng = random.Random(self.seed)
+        block = ''.join([chr(rng.randrange(256)) for i in range(64 * 1024)])
+        # Shot over a couple of weeks in the spring of 2012
+        start = time.mktime((2012, 3, 1, 9, 0, 0, 0, 0, -1))
+        files = [0, 0]
+        n = [0]
+
+        def shot():
+            return time.localtime(start + rng.randrange(14 * 24 * 3600))
+
+        def put(dirname, fname, data, counted = True):
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(os.path.join(dirname, fname), 'wb') as f:
+                f.write(data)
+            if counted:
+                files[0] += 1
+                files[1] += len(data)
+
+        def body(size):
+            n[0] += 1
+            return padding(n[0], max(0, int(rng.gauss(size, size / 4))), block)
+
+        dcim = os.path.join(top, 'DCIM')
+        for i in range(self.photos):
+            folder = os.path.join(dcim, '%03dCANON' % (100 + i / 100,))
+            fname = 'IMG_%04d.JPG' % (i + 1,)
+            put(folder, fname, exif_jpeg(shot(), body(self.photo_size)))
+            if i % 10 == 0:
+                # Edited copies and thumbnails, which are never imported
+                for skip in SKIPPED:
+                    put(os.path.join(folder, skip), fname, exif_jpeg(shot(), body(self.photo_size / 16)), False)
+            if i % 25 == 0:
+                put(folder, 'IMG_%04d.THM' % (i + 1,), body(4096), False)
+
+        # Four ways of telling a video's date: a JPEG beside it, its movie header,
+        # and the two naming conventions phones use
+        for i in range(self.videos):
+            when = shot()
+            data = quicktime(when, body(self.video_size))
+            kind = i % 4
+            if kind == 0:
+                folder = os.path.join(dcim, '100CANON')
+                put(folder, 'MVI_%04d.MOV' % (9000 + i,), data)
+                put(folder, 'MVI_%04d.JPG' % (9000 + i,), exif_jpeg(when, body(self.photo_size / 8)))
+            elif kind == 1:
+                put(os.path.join(dcim, '100CANON'), 'MVI_%04d.MP4' % (9000 + i,), data)
+            elif kind == 2:
+                put(os.path.join(dcim, '101PHONE'), time.strftime('%y%m%d%H%M%S', when) + '.mov', data)
+            else:
+                put(os.path.join(dcim, '101PHONE'), time.strftime('Video%m%d%H%M.3gp', when), data)
+
+        put(os.path.join(top, 'MISC'), 'readme.txt', 'Not media\n', False)
+        return tuple(files)
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [options] <dir>")
+    parser.add_option("-p", "--photos", default=200, type="int",
+                      dest="photos", help="How many photos to make")
+    parser.add_option("-m", "--movies", default=20, type="int",
+                      dest="videos", help="How many videos to make")
+    parser.add_option("--photo-kb", default=512, type="int",
+                      dest="photo_kb", help="Average size of a photo in KB")
+    parser.add_option("--movie-kb", default=4096, type="int",
+                      dest="video_kb", help="Average size of a video in KB")
+    parser.add_option("-s", "--seed", default=1, type="int",
+                      dest="seed", help="Seed for the random choices")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Where should the card go?")
+    corpus = Corpus(options.photos, options.videos, options.photo_kb * 1024, options.video_kb * 1024, options.seed)
+    (count, size) = corpus.write(args[0])
+    print "Made %d media files, %.1f MB, in %s" % (count, size / 1048576.0, args[0])
+
+if __name__ == "__main__":
+    main()
+
+#vim:sw=4:ts=4
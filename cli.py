@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['parse_args', 'main']
+
+import os
+import sys
+import platform
+
+def parse_args(args = None):
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option("-r", "--reinspect", default=True, action="store_false",
+                      dest="skip_already_imported", help="Re-inspect any file that's been inspected before")
+    parser.add_option("-v", "--verbose", default=1, action="count",
+                      dest="verbosity", help="Increase verbosity")
+    parser.add_option("-n", "--nothing", default=False, action="store_true",
+                      dest="dry_run", help="Don't do anything, do a dry run")
+    parser.add_option("-d", "--dest", default=["<shell:Pictures>"], action="append",
+                      dest="dest_dirs", help="Destination")
+    parser.add_option("-f", "--forget", default=False, action="store_true",
+                      dest="forget", help="Do no scanning, just forget anything about these sources")
+    parser.add_option("-j", "--jobs", default=4, type="int",
+                      dest="jobs", help="Number of files to examine at once")
+    parser.add_option("--source-jobs", default=0, type="int",
+                      dest="source_jobs", help="Most files to read from any one source device at once (default: --jobs, or 1 for a spinning disk)")
+    parser.add_option("-c", "--copy-jobs", default=4, type="int",
+                      dest="copy_jobs", help="Number of files to copy at once")
+    parser.add_option("--device-jobs", default=2, type="int",
+                      dest="device_jobs", help="Most files to write to any one device at once")
+    parser.add_option("--raw", default=False, action="store_true",
+                      dest="raws", help="Import raw photos (.CR2, .NEF, .DNG and the like) too")
+    parser.add_option("--no-cache", default=True, action="store_false",
+                      dest="use_cache", help="Don't use or update the cache of file details")
+    parser.add_option("--verify", default=False, action="store_true",
+                      dest="verify", help="Hash each file as it's copied and check it against what's known, "
+                                          "then read each copy back and compare it with the source; "
+                                          "the copy may be read back from the OS's cache rather than the disk")
+    parser.add_option("--no-sync", default=True, action="store_false",
+                      dest="sync", help="Don't wait for the copies' directories to reach the disk before remembering what's in them")
+    parser.add_option("--fsync", default=False, action="store_true",
+                      dest="fsync", help="Wait for each copy's contents to reach the disk too; slower")
+    parser.add_option("--link", default="reflink", type="choice", choices=["reflink", "hardlink", "copy"],
+                      dest="link", help="How to import to the source's own filesystem: reflink (clone it where that works), hardlink or copy")
+    parser.add_option("--save-plan", default=None, metavar="FILE",
+                      dest="plan_file", help="Save the import plan to FILE")
+    parser.add_option("--resume", default=False, action="store_true",
+                      dest="resume", help="Carry on with the latest interrupted import that isn't still running")
+    parser.add_option("--profile", default=None, metavar="FILE",
+                      dest="profile", help="Write how long each phase took, and what it did, to FILE as JSON")
+    parser.add_option("--cprofile", default=None, metavar="FILE",
+                      dest="cprofile", help="Run the import under cProfile and dump its stats to FILE")
+    parser.add_option("--console", default=False, action="store_true",
+                      dest="console", help="Don't open a window, just say what's going on on the console")
+    parser.add_option("--watch", default=False, action="store_true",
+                      dest="watch", help="After importing, keep watching the sources and import what turns up in them (on the console)")
+    (options, sources) = parser.parse_args(args)
+    return (options, sources)
+
+def can_show_window():
+    if platform.system() not in ('Windows', 'Darwin') and not os.environ.get('DISPLAY'):
+        return False
+    try:
+        import wx
+    except ImportError:
+        return False
+    return True
+
+def wait_for(importer):
+    """ Until importer's done, stopping it if Ctrl-C is pressed
+    """
+    try:
+        while importer.isAlive():
+            importer.join(0.25)
+    except KeyboardInterrupt:
+        importer.interrupt.set()
+        importer.join()
+        raise
+
+def run_console(options, sources):
+    from importer import Importer
+    from sinks import ConsoleSink
+    importer = Importer(ConsoleSink(), sources, options)
+    try:
+        wait_for(importer)
+    except KeyboardInterrupt:
+        pass
+    return 0 if importer.error is None else 1
+
+def run_watch(options, sources):
+    import itertools
+    from threading import Event
+    from importer import Importer
+    from sinks import ConsoleSink
+    from watch import Watcher
+    sink = ConsoleSink()
+    interrupt = Event()
+    # Start watching first, so nothing turning up while we catch up is missed
+    watcher = Watcher([s for s in sources if os.path.isdir(s)], Importer.skip_dirs, interrupt, raws=options.raws)
+    failed = False
+    try:
+        try:
+            for batch in itertools.chain([sources], watcher.batches()):
+                # Each lot goes through a whole import of its own, so it's remembered as soon as it's in
+                importer = Importer(sink, batch, options)
+                wait_for(importer)
+                if importer.error is not None:
+                    # Carry on watching, but say so when we're done
+                    failed = True
+                sink.logger("Watching %s" % (", ".join(watcher.roots),))
+        except KeyboardInterrupt:
+            interrupt.set()
+    finally:
+        watcher.close()
+    return 1 if failed else 0
+
+def main():
+    (options, sources) = parse_args()
+    if len(sources) > 0 or options.resume:
+        # Only load wx when there's a window to show, it's most of the time spent starting up
+        if options.watch:
+            sys.exit(run_watch(options, sources))
+        if options.console or not can_show_window():
+            sys.exit(run_console(options, sources))
+        from frame import main
+        main(options, sources)
+
+#vim:sw=4:ts=4
@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['Progress', 'sync_dir', 'SharedSource', 'fan_out', 'first_difference', 'link_file', 'device_of', 'SpaceLedger', 'CopyEngine']
+
+import os
+import errno
+import platform
+import shutil
+import time
+import ctypes
+import ctypes.util
+from collections import deque
+from threading import Lock, Condition
+from workers import WorkerPool
+
+IS_WINDOWS = (platform.system() == 'Windows')
+if not IS_WINDOWS:
+    import fcntl
+BUFFER_SIZE = 1024 * 1024
+# From linux/fs.h: make the file share another's blocks, copy on write
+FICLONE = 0x40049409
+
+# Errors meaning the kernel can't copy between these two files, rather than that it went wrong
+KERNEL_COPY_UNSUPPORTED = set([getattr(errno, name) for name in
+                               ('EXDEV', 'EINVAL', 'ENOSYS', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF')
+                               if hasattr(errno, name)])
+
+# Errors meaning these two files can't share their data, rather than that it went wrong
+LINK_UNSUPPORTED = set([getattr(errno, name) for name in
+                        ('EXDEV', 'EINVAL', 'ENOSYS', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY', 'EPERM', 'EMLINK')
+                        if hasattr(errno, name)])
+
+# The os module has neither copy_file_range nor sendfile, so they come from libc
+LIBC = None
+if not IS_WINDOWS:
+    try:
+        LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        pass
+COPY_FILE_RANGE = getattr(LIBC, 'copy_file_range', None)
+if COPY_FILE_RANGE is not None:
+    COPY_FILE_RANGE.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_int,
+                                ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t, ctypes.c_uint]
+    COPY_FILE_RANGE.restype = ctypes.c_ssize_t
+SENDFILE = getattr(LIBC, 'sendfile64', None)
+if SENDFILE is not None:
+    SENDFILE.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_longlong), ctypes.c_size_t]
+    SENDFILE.restype = ctypes.c_ssize_t
+
+def kernel_copy(src_fd, dest_fd, offset, count):
+    """ Have the kernel copy count bytes at offset from src_fd to the same
+        place in dest_fd, without them coming through us.
+        Returns how many it copied, or None if it can't do that here.
+    """
+    for call in (COPY_FILE_RANGE, SENDFILE):
+        if call is None:
+            continue
+        while True:
+            off_in = ctypes.c_longlong(offset)
+            if call is COPY_FILE_RANGE:
+                off_out = ctypes.c_longlong(offset)
+                n = call(src_fd, ctypes.byref(off_in), dest_fd, ctypes.byref(off_out), count, 0)
+            else:
+                os.lseek(dest_fd, offset, os.SEEK_SET)
+                n = call(dest_fd, src_fd, ctypes.byref(off_in), count)
+            if n >= 0:
+                return n
+            e = ctypes.get_errno()
+            if e != errno.EINTR:
+                break
+        if e not in KERNEL_COPY_UNSUPPORTED:
+            raise OSError(e, os.strerror(e))
+    return None
+
+class Progress(object):
+    """ Sizes copy chunks so each takes about CHUNK_SECONDS, stops between
+        them if interrupted, and every REPORT_EVERY seconds tells report
+        (done, total, bytes per second, seconds left)
+    """
+    MIN_CHUNK = 64 * 1024
+    MAX_CHUNK = 16 * 1024 * 1024
+    CHUNK_SECONDS = 0.25
+    REPORT_EVERY = 1.0
+
+    def __init__(self, total, report = None, interrupt = None):
+        self.total = total
+        self.report = report
+        self.interrupt = interrupt
+        self.done = 0
+        self.chunk = BUFFER_SIZE
+        self.started = self.reported = self.chunk_started = time.time()
+
+    def next_chunk(self):
+        if self.interrupt is not None and self.interrupt.is_set():
+            raise UserWarning("Copy interrupted")
+        self.chunk_started = time.time()
+        return self.chunk
+
+    def advance(self, n):
+        now = time.time()
+        took = now - self.chunk_started
+        self.done += n
+        if took < Progress.CHUNK_SECONDS / 2:
+            self.chunk = min(self.chunk * 2, Progress.MAX_CHUNK)
+        elif took > Progress.CHUNK_SECONDS * 2:
+            self.chunk = max(self.chunk // 2, Progress.MIN_CHUNK)
+        if self.report and now - self.reported >= Progress.REPORT_EVERY:
+            self.reported = now
+            rate = self.done / (now - self.started)
+            eta = ((self.total - self.done) / rate) if rate else None
+            self.report(self.done, self.total, rate, eta)
+
+def sync_dir(path):
+    """ Make sure the names in directory path are on disk.
+        Windows has no way to, nor needs to.
+    """
+    if IS_WINDOWS:
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SharedSource(object):
+    """ A file being copied to several devices at once, each by its own
+        writer.  The last RING chunks read of it are kept, so the writers
+        keeping up with each other read it once between them; one that's
+        fallen further behind than that reads it for itself.
+    """
+    RING = 16
+
+    def __init__(self, path):
+        self.path = path
+        self.cond = Condition(Lock())
+        # offset -> chunk, the offsets in the order read
+        self.chunks = {}
+        self.order = deque()
+        # Offsets someone's reading now
+        self.reading = set()
+        self.hits = self.misses = 0
+
+    def read(self, f, pos):
+        """ The BUFFER_SIZE bytes of the file at pos, from the ring if
+            they're there, otherwise read from f
+        """
+        with self.cond:
+            while pos in self.reading:
+                self.cond.wait()
+            buf = self.chunks.get(pos, None)
+            if buf is not None:
+                self.hits += 1
+                return buf
+            self.misses += 1
+            self.reading.add(pos)
+        buf = None
+        try:
+            f.seek(pos)
+            buf = f.read(BUFFER_SIZE)
+        finally:
+            with self.cond:
+                self.reading.discard(pos)
+                # Only the front is worth keeping
+                if buf is not None and (not self.order or pos > self.order[-1]):
+                    self.chunks[pos] = buf
+                    self.order.append(pos)
+                    while len(self.order) > SharedSource.RING:
+                        del self.chunks[self.order.popleft()]
+                self.cond.notify_all()
+        return buf
+
+def fan_out(src, dests, starts = None, hasher = None, progress = None, sync = False, source = None):
+    """ Copy src to every path in dests, reading each chunk of src once.
+        Each dest is written from its offset in starts, keeping what's
+        before it.  If hasher is given every byte of src goes through it,
+        so the copy is done by us; otherwise the kernel does it if it can.
+        source, a SharedSource, shares the reading with writers to other
+        devices, so the copy is done by us then too.
+        With sync, the copies' contents are on disk before this returns,
+        though their names won't be until their directory is synced.
+    """
+    if starts is None:
+        starts = [0] * len(dests)
+    outs = []
+    try:
+        for (dest, start) in zip(dests, starts):
+            out = open(dest, 'r+b' if start else 'wb')
+            out.seek(start)
+            out.truncate()
+            outs.append(out)
+        with open(src, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if progress is None:
+                progress = Progress(0)
+            progress.total = sum([size - start for start in starts])
+            todo = range(len(outs))
+            if hasher is None and source is None:
+                for i in todo[:]:
+                    pos = starts[i]
+                    while pos < size:
+                        n = kernel_copy(f.fileno(), outs[i].fileno(), pos, min(progress.next_chunk(), size - pos))
+                        if not n:
+                            break
+                        pos += n
+                        progress.advance(n)
+                    if pos >= size:
+                        todo.remove(i)
+                    else:
+                        # Carry on from where the kernel got to, the slow way
+                        starts[i] = pos
+                        outs[i].seek(pos)
+                        outs[i].truncate()
+            if todo:
+                # The hash needs all of it, otherwise just what someone's missing
+                pos = 0 if hasher is not None else min([starts[i] for i in todo])
+                f.seek(pos)
+                while True:
+                    if source is not None:
+                        # Still a chance to stop
+                        progress.next_chunk()
+                        buf = source.read(f, pos)
+                    else:
+                        buf = f.read(progress.next_chunk())
+                    if not buf:
+                        break
+                    if hasher is not None:
+                        hasher.update(buf)
+                    end = pos + len(buf)
+                    written = 0
+                    for i in todo:
+                        if end > starts[i]:
+                            piece = buf[max(0, starts[i] - pos):]
+                            outs[i].write(piece)
+                            written += len(piece)
+                    pos = end
+                    progress.advance(written)
+        if sync:
+            for out in outs:
+                out.flush()
+                os.fsync(out.fileno())
+    finally:
+        for out in outs:
+            out.close()
+    for dest in dests:
+        shutil.copystat(src, dest)
+
+def first_difference(src, dest, start = 0, interrupt = None):
+    """ The offset of the first byte at or after start where dest differs
+        from src, or None if they're the same from there on.
+        Setting interrupt stops it between chunks.
+    """
+    with open(src, 'rb') as a:
+        with open(dest, 'rb') as b:
+            a.seek(start)
+            b.seek(start)
+            pos = start
+            while True:
+                if interrupt is not None and interrupt.is_set():
+                    raise UserWarning("Copy interrupted")
+                x = a.read(BUFFER_SIZE)
+                y = b.read(BUFFER_SIZE)
+                if x != y:
+                    for (i, (p, q)) in enumerate(zip(x, y)):
+                        if p != q:
+                            return pos + i
+                    # One's a prefix of the other
+                    return pos + min(len(x), len(y))
+                if not x:
+                    return None
+                pos += len(x)
+
+def link_file(src, dest, mode):
+    """ Make dest share src's data instead of copying it.  mode 'reflink'
+        clones it, copy on write, where the filesystem can; 'hardlink'
+        makes dest another name for src.  Returns whether it did, leaving
+        no dest behind if not.
+    """
+    try:
+        if mode == 'hardlink' and hasattr(os, 'link'):
+            os.link(src, dest)
+            return True
+        if mode == 'reflink' and not IS_WINDOWS:
+            with open(src, 'rb') as f:
+                out = open(dest, 'wb')
+                try:
+                    fcntl.ioctl(out.fileno(), FICLONE, f.fileno())
+                except:
+                    out.close()
+                    os.unlink(dest)
+                    raise
+                out.close()
+            shutil.copystat(src, dest)
+            return True
+    except (IOError, OSError), e:
+        if e.errno in LINK_UNSUPPORTED:
+            return False
+        raise
+    return False
+
+def existing_ancestor(path):
+    """ path, or the nearest directory above it that's there already
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def device_of(path):
+    """ Something that identifies the device path lives (or will live) on
+    """
+    path = os.path.abspath(path)
+    if IS_WINDOWS:
+        (drive, rest) = os.path.splitdrive(path)
+        return drive.upper()
+    # The directory may not have been made yet, so ask its nearest ancestor
+    return os.stat(existing_ancestor(path)).st_dev
+
+class SpaceLedger(object):
+    """ Free space on each destination filesystem, measured once and then
+        kept account of: each copy reserves its size before it starts and
+        settles up with what it really used once it's done
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.free = {}
+        self.reserved = {}
+
+    def __filesystem(self, dest_dir):
+        from path_metadata import PathMetadata
+        dev = device_of(dest_dir)
+        with self.lock:
+            if dev not in self.free:
+                self.free[dev] = PathMetadata(existing_ancestor(dest_dir)).get_free_space()
+                self.reserved[dev] = 0
+        return dev
+
+    def reserve(self, dest_dir, size):
+        dev = self.__filesystem(dest_dir)
+        with self.lock:
+            if size >= self.free[dev] - self.reserved[dev]:
+                raise UserWarning("Ran out of disk space")
+            self.reserved[dev] += size
+
+    def settle(self, dest_dir, reserved, used):
+        dev = self.__filesystem(dest_dir)
+        with self.lock:
+            self.reserved[dev] -= reserved
+            self.free[dev] -= used
+
+    def preflight(self, needs):
+        """ Check that everything in needs, (dest_dir, size) pairs, will fit.
+            Returns a list of (dest_dir, needed, available) for filesystems
+            that it won't, naming each by the first dest_dir on it.
+        """
+        wanted = {}
+        first = {}
+        for (dest_dir, size) in needs:
+            dev = self.__filesystem(dest_dir)
+            wanted[dev] = wanted.get(dev, 0) + size
+            first.setdefault(dev, dest_dir)
+        short = []
+        with self.lock:
+            for (dev, size) in wanted.items():
+                available = self.free[dev] - self.reserved[dev]
+                if size >= available:
+                    short.append((first[dev], size, available))
+        return short
+
+class CopyEngine(object):
+    """ Runs copy jobs with a queue of writers for each destination device,
+        per_device of them, so a slow device falls behind on its own rather
+        than holding up the others.  No more than workers copies run at once.
+        A job is a list of (src_md, dest_dirs, visitor), the files of one
+        shot, which each device copies one after another.  A file's
+        destinations on one device share a read of it, and the devices
+        share one through a SharedSource.
+    """
+
+    def __init__(self, workers = 1, per_device = 1, interrupt = None, verify = False, ledger = None, index = None, sync = False, link = None, partial = False):
+        from dest_index import DestIndex
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+        # A device may get this far ahead of the slowest before they wait for it
+        self.pool = WorkerPool(self.per_device, interrupt, self.workers * 4)
+        self.interrupt = self.pool.interrupt
+        self.ledger = ledger if ledger is not None else SpaceLedger()
+        self.index = index if index is not None else DestIndex()
+        self.sync = sync
+        self.link = link
+        # Carry on with copies a stopped import left part done
+        self.partial = partial
+        self.verify = verify
+        self.lock = Lock()
+        self.devices = {}
+
+    def __device(self, dest_dir):
+        with self.lock:
+            dev = self.devices.get(dest_dir, None)
+            if dev is None:
+                dev = self.devices[dest_dir] = device_of(dest_dir)
+            return dev
+
+    def __parts(self, jobs, outstanding):
+        # Split each job into the destinations on each device
+        for job in jobs:
+            devs = {}
+            for (n, (src_md, dest_dirs, visitor)) in enumerate(job):
+                for (idx, dest_dir) in enumerate(dest_dirs):
+                    devs.setdefault(self.__device(dest_dir), []).append((n, idx))
+            # Files going to more than one device get read once between them
+            sources = []
+            for (n, (src_md, dest_dirs, visitor)) in enumerate(job):
+                spread = len([dev for (dev, places) in devs.items() if [m for (m, idx) in places if m == n]])
+                sources.append(SharedSource(src_md.path) if spread > 1 else None)
+            with self.lock:
+                outstanding[id(job)] = [len(devs), [[False] * len(dest_dirs) for (src_md, dest_dirs, visitor) in job]]
+            for (dev, places) in devs.items():
+                yield (job, dev, places, sources)
+
+    def __copy(self, part):
+        (job, dev, places, sources) = part
+        copied = []
+        for (n, (src_md, dest_dirs, visitor)) in enumerate(job):
+            idxs = [idx for (m, idx) in places if m == n]
+            if idxs:
+                did = src_md.copy_to_all([dest_dirs[idx] for idx in idxs], False, visitor, self.verify, self.interrupt,
+                                         self.ledger, self.index, self.sync, self.link, sources[n], self.partial)
+                copied.extend(zip([(n, idx) for idx in idxs], did))
+        return copied
+
+    def run(self, jobs):
+        """ Yields (job, copied) as each job finishes on every device, where
+            copied has a list of booleans for each of the job's files, one
+            per dest_dir, as copy_to_all returns
+        """
+        outstanding = {}
+        parts = self.__parts(jobs, outstanding)
+        for ((job, dev, places, sources), copied) in self.pool.imap_by(self.__copy, parts, lambda part: part[1], self.workers):
+            with self.lock:
+                state = outstanding[id(job)]
+                for ((n, idx), did) in copied:
+                    state[1][n][idx] = did
+                state[0] -= 1
+                if state[0] > 0:
+                    continue
+                del outstanding[id(job)]
+            yield (job, state[1])
+
+#vim:sw=4:ts=4
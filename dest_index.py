@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['DestIndex']
+
+import os
+import stat
+from threading import Lock
+
+class DestIndex(object):
+    """ What's in the destination directories, listing each one only the
+        first time it's asked about and keeping up with what the import
+        adds, so deciding what to copy and where doesn't keep going back
+        to what may be a network share
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        # directory -> {name: size or None if not looked at yet}, or None if there's no such directory
+        self.dirs = {}
+        # (directory, name) claimed for copies still being made
+        self.claimed = set()
+        # Directories listed, and questions answered without going to the disk
+        self.listings = self.lookups = 0
+
+    def __listing(self, dest_dir):
+        # Called holding the lock
+        if dest_dir not in self.dirs:
+            self.listings += 1
+            try:
+                self.dirs[dest_dir] = dict([(name, None) for name in os.listdir(dest_dir)])
+            except OSError:
+                self.dirs[dest_dir] = None
+        else:
+            self.lookups += 1
+        return self.dirs[dest_dir]
+
+    def isdir(self, dest_dir):
+        with self.lock:
+            return self.__listing(dest_dir) is not None
+
+    def exists(self, dest_dir, fname):
+        with self.lock:
+            listing = self.__listing(dest_dir)
+            return listing is not None and fname in listing
+
+    def size(self, dest_dir, fname):
+        """ Size of fname in dest_dir, or None if it isn't there, or is
+            still being copied there
+        """
+        with self.lock:
+            listing = self.__listing(dest_dir)
+            if listing is None or fname not in listing or (dest_dir, fname) in self.claimed:
+                return None
+            size = listing[fname]
+        if size is None:
+            try:
+                size = os.stat(os.path.join(dest_dir, fname))[stat.ST_SIZE]
+            except OSError:
+                return None
+            with self.lock:
+                listing[fname] = size
+        return size
+
+    def claim(self, dest_dir, fname):
+        """ Takes fname in dest_dir for a copy about to be made there, in the
+            same step as checking for it, so two copies of different files
+            with the same name can't both go ahead.  False if it's there
+            already or another copy has it.  removed() gives it back.
+        """
+        with self.lock:
+            listing = self.__listing(dest_dir)
+            if listing is None:
+                # It's being made
+                listing = self.dirs[dest_dir] = {}
+            if fname in listing:
+                return False
+            listing[fname] = None
+            self.claimed.add((dest_dir, fname))
+            return True
+
+    def made_dir(self, dest_dir):
+        with self.lock:
+            if self.dirs.get(dest_dir, None) is None:
+                self.dirs[dest_dir] = {}
+
+    def added(self, dest_dir, fname, size):
+        with self.lock:
+            listing = self.dirs.get(dest_dir, None)
+            if listing is None:
+                listing = self.dirs[dest_dir] = {}
+            listing[fname] = size
+            self.claimed.discard((dest_dir, fname))
+
+    def removed(self, dest_dir, fname):
+        # Such as a claimed name whose copy didn't happen
+        with self.lock:
+            listing = self.dirs.get(dest_dir, None)
+            if listing is not None:
+                listing.pop(fname, None)
+            self.claimed.discard((dest_dir, fname))
+
+#vim:sw=4:ts=4
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['DigestIndex']
+
+import os
+import mmap
+import struct
+
+class DigestIndex(object):
+    """ A sorted file of binary digests, memory-mapped, with a Bloom filter
+        stored after them so most unknown digests never touch the sorted part.
+        Layout: header | count * DIGEST_SIZE sorted digests | Bloom filter bits
+    """
+    MAGIC = 'IPDX'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQI')
+    DIGEST_SIZE = 20
+    BITS_PER_ENTRY = 10
+    HASHES = 7
+
+    def __init__(self, path):
+        self.path = path
+        self.f = self.mm = None
+        self.count = self.bloom_bits = self.hashes = 0
+        if os.path.isfile(path):
+            self.f = open(path, 'rb')
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, self.count, self.bloom_bits, self.hashes) = DigestIndex.HEADER.unpack_from(self.mm, 0)
+            if magic != DigestIndex.MAGIC or version != DigestIndex.VERSION:
+                self.close()
+                raise ValueError("%s is not a digest index" % (path,))
+            self.bloom_at = DigestIndex.HEADER.size + self.count * DigestIndex.DIGEST_SIZE
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        self.count = 0
+
+    @staticmethod
+    def bit_positions(digest, bits, hashes):
+        # The digests are already uniformly distributed, so double hash from their bytes
+        (h1, h2) = struct.unpack_from('<II', digest)
+        h2 |= 1
+        return [(h1 + i * h2) % bits for i in range(hashes)]
+
+    def __digest_at(self, idx):
+        at = DigestIndex.HEADER.size + idx * DigestIndex.DIGEST_SIZE
+        return self.mm[at:at + DigestIndex.DIGEST_SIZE]
+
+    def __contains__(self, digest):
+        if self.count == 0:
+            return False
+        for bit in DigestIndex.bit_positions(digest, self.bloom_bits, self.hashes):
+            if not ord(self.mm[self.bloom_at + (bit >> 3)]) & (1 << (bit & 7)):
+                return False
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            d = self.__digest_at(mid)
+            if d < digest:
+                lo = mid + 1
+            elif d > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for idx in xrange(self.count):
+            yield self.__digest_at(idx)
+
+    @staticmethod
+    def write(path, digests, capacity):
+        """ Write digests, which must come sorted and unique, to path.
+            capacity is the most there could be, and sizes the Bloom filter.
+        """
+        bloom_bits = max(64, capacity * DigestIndex.BITS_PER_ENTRY)
+        bloom = bytearray((bloom_bits + 7) >> 3)
+        count = 0
+        with open(path, 'wb') as f:
+            f.write(DigestIndex.HEADER.pack(DigestIndex.MAGIC, DigestIndex.VERSION, 0, bloom_bits, DigestIndex.HASHES))
+            for digest in digests:
+                for bit in DigestIndex.bit_positions(digest, bloom_bits, DigestIndex.HASHES):
+                    bloom[bit >> 3] |= (1 << (bit & 7))
+                f.write(digest)
+                count += 1
+            f.write(bloom)
+            # Now we know how many there really were
+            f.seek(0)
+            f.write(DigestIndex.HEADER.pack(DigestIndex.MAGIC, DigestIndex.VERSION, count, bloom_bits, DigestIndex.HASHES))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def merge(old, added, removed):
+        """ Yield the sorted union of the digests in old (an iterable of
+            sorted digests) and added (a sorted list), minus those in removed
+        """
+        it = iter(old)
+        a = 0
+        prev = None
+        for d in it:
+            while a < len(added) and added[a] < d:
+                if added[a] not in removed and added[a] != prev:
+                    prev = added[a]
+                    yield prev
+                a += 1
+            if d not in removed and d != prev:
+                prev = d
+                yield d
+        while a < len(added):
+            if added[a] not in removed and added[a] != prev:
+                prev = added[a]
+                yield prev
+            a += 1
+
+#vim:sw=4:ts=4
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['date_time_original', 'MalformedExif']
+
+import struct
+
+SOI = '\xff\xd8'
+APP1 = 0xe1
+SOS = 0xda
+EOI = 0xd9
+EXIF_HEADER = 'Exif\x00\x00'
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+ASCII = 2
+# Cameras put APP1 first, but allow for a JFIF APP0 or two in front of it
+MAX_SEGMENTS = 8
+MAX_IFD_ENTRIES = 512
+
+class MalformedExif(ValueError):
+    pass
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise MalformedExif("Truncated EXIF data")
+    return data
+
+def find_tag(f, tiff_start, endian, ifd_offset, wanted):
+    """ Return (type, count, value/offset field) of tag wanted in the IFD at ifd_offset
+    """
+    f.seek(tiff_start + ifd_offset)
+    (count,) = struct.unpack(endian + 'H', read_exactly(f, 2))
+    if count > MAX_IFD_ENTRIES:
+        raise MalformedExif("Implausible IFD entry count %d" % (count,))
+    entries = read_exactly(f, 12 * count)
+    for i in range(count):
+        (tag, typ, n, value) = struct.unpack_from(endian + 'HHI4s', entries, 12 * i)
+        if tag == wanted:
+            return (typ, n, value)
+    return None
+
+def date_time_original(f):
+    """ Read just the EXIF DateTimeOriginal from the JPEG open as f, with a
+        handful of small reads.  Returns None if there isn't one and raises
+        MalformedExif if the file doesn't look how we expect.
+    """
+    f.seek(0)
+    if read_exactly(f, 2) != SOI:
+        raise MalformedExif("Not a JPEG")
+    for i in range(MAX_SEGMENTS):
+        (ff, marker, length) = struct.unpack('>BBH', read_exactly(f, 4))
+        if ff != 0xff:
+            raise MalformedExif("Lost JPEG marker sync")
+        if marker in (SOS, EOI):
+            return None
+        if marker == APP1:
+            segment_start = f.tell()
+            if read_exactly(f, 6) == EXIF_HEADER:
+                break
+            f.seek(segment_start)
+        f.seek(length - 2, 1)
+    else:
+        return None
+    tiff_start = f.tell()
+    header = read_exactly(f, 8)
+    if header[0:2] == 'II':
+        endian = '<'
+    elif header[0:2] == 'MM':
+        endian = '>'
+    else:
+        raise MalformedExif("Bad TIFF byte order")
+    (magic, ifd0) = struct.unpack(endian + 'HI', header[2:8])
+    if magic != 42:
+        raise MalformedExif("Bad TIFF magic")
+    found = find_tag(f, tiff_start, endian, ifd0, EXIF_IFD_POINTER)
+    if found is None:
+        return None
+    (exif_ifd,) = struct.unpack(endian + 'I', found[2])
+    found = find_tag(f, tiff_start, endian, exif_ifd, DATE_TIME_ORIGINAL)
+    if found is None:
+        return None
+    (typ, n, value) = found
+    if typ != ASCII or n < 19:
+        raise MalformedExif("Odd DateTimeOriginal")
+    (offset,) = struct.unpack(endian + 'I', value)
+    f.seek(tiff_start + offset)
+    return read_exactly(f, n).rstrip('\x00 ')
+
+#vim:sw=4:ts=4
@@ -27,82 +27,121 @@ from __future__ import with_statement
 
 import wx
 from importer import Importer
+from sinks import SinkClosed
 from threading import Lock
+from collections import deque
+
+class WindowSink(object):
+    """ Gathers up an Importer's messages for the window to collect a few
+        times a second, rather than interrupting its thread for each one
+    """
+    def __init__(self, max_lines):
+        self.lock = Lock()
+        # Anything older would have scrolled out of the log anyway
+        self.lines = deque(maxlen=max_lines)
+        self.twiddling = False
+        self.advances = 0
+        self.closed = False
+
+    def __check(self):
+        if self.closed:
+            raise SinkClosed()
+
+    def logger(self, s):
+        with self.lock:
+            self.__check()
+            self.lines.append(s)
+
+    def twiddle(self, mode):
+        # Mode (0, 1, 2) == (start, advance, stop)
+        with self.lock:
+            self.__check()
+            if mode == 1:
+                self.advances += 1
+            else:
+                self.twiddling = (mode == 0)
+
+    def take(self):
+        """ (lines, twiddling, advances) since the last time
+        """
+        with self.lock:
+            lines = list(self.lines)
+            self.lines.clear()
+            advances = self.advances
+            self.advances = 0
+            return (lines, self.twiddling, advances)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+class LogView(wx.ListCtrl):
+    """ The last MAX_LINES lines logged, kept in a ring and drawn by a
+        virtual list, so neither memory nor redrawing grows with the import
+    """
+    MAX_LINES = 10000
+
+    def __init__(self, parent):
+        wx.ListCtrl.__init__(self, parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_NO_HEADER | wx.LC_SINGLE_SEL)
+        self.InsertColumn(0, "", width=4000)
+        self.lines = deque(maxlen=LogView.MAX_LINES)
+
+    def OnGetItemText(self, item, column):
+        return self.lines[item]
+
+    def append(self, lines):
+        self.lines.extend(lines)
+        self.SetItemCount(len(self.lines))
+        self.EnsureVisible(len(self.lines) - 1)
+        self.Refresh()
 
 class MyFrame(wx.Frame):
     """ We simply derive a new class of Frame. """
+    # Times a second the window catches up with the importer
+    FRAME_RATE = 10
+
     def __init__(self, parent, title, opts, sources):
         wx.Frame.__init__(self, parent, title=title, size=((800 if opts.verbosity < 2 else 1100), 400))
-        self.lock = Lock()
         self.opts = opts
-        self.control = wx.TextCtrl(self, style=wx.TE_MULTILINE)
-        self.control.SetEditable(False)
+        self.control = LogView(self)
+        self.CreateStatusBar()
         self.Show(True)
-        self.twiddle_mode = 2
         self.twiddle_next = 0
         self.twiddle_me = '|/-\\'
         self.twiddle_size = len(self.twiddle_me)
-        self.importer = Importer(self, sources, self.opts)
+        self.examined = 0
+        self.sink = WindowSink(LogView.MAX_LINES)
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onTimer, self.timer)
+        self.timer.Start(1000 / MyFrame.FRAME_RATE)
+        self.importer = Importer(self.sink, sources, self.opts)
         self.Bind(wx.EVT_CLOSE, self.onClose)
 
     def onClose(self, event):
+        self.sink.close()
+        self.timer.Stop()
         self.importer.interrupt.set()
         while self.importer.isAlive():
             self.importer.join(1)
             wx.Yield()
         self.Destroy()
 
-    def __append_text(self, s):
-        with self.lock:
-            self.control.AppendText(s)
+    def onTimer(self, event):
+        (lines, twiddling, advances) = self.sink.take()
+        if lines:
+            self.control.append(lines)
+        if twiddling:
+            self.examined += advances
+            self.twiddle_next = (self.twiddle_next + min(advances, 1)) % self.twiddle_size
+            self.SetStatusText("%s %d" % (self.twiddle_me[self.twiddle_next], self.examined))
+        elif self.examined:
+            self.examined = 0
+            self.SetStatusText("")
 
-    def logger(self, s):
-        # print s
-        if self.twiddle_mode != 2:
-            re_twiddle = True
-            self.twiddle(2)
-        else:
-            re_twiddle = False
-        self.__append_text("%s\n" % (s,))
-        if re_twiddle:
-            self.twiddle(0)
-
-    def twiddle(self, mode):
-        # Mode (0, 1, 2) == (start (add first twiddle), advance, erase)
-        self.twiddle_mode = mode
-        if mode == 0:
-            # append
-            self.twiddle_next = 0
-            self.__append_text(self.twiddle_me[self.twiddle_next])
-        elif mode == 1:
-            # replace
-            lastPos = self.control.GetLastPosition()
-            self.control.Replace(lastPos-1, lastPos, self.twiddle_me[self.twiddle_next])
-        elif mode == 2:
-            # erase
-            lastPos = self.control.GetLastPosition()
-            self.control.Remove(lastPos-1, lastPos)
-        # Advance
-        self.twiddle_next = (self.twiddle_next + 1) % self.twiddle_size
-
-def main():
-    from optparse import OptionParser
-    parser = OptionParser()
-    parser.add_option("-r", "--reinspect", default=True, action="store_false",
-                      dest="skip_already_imported", help="Re-inspect any file that's been inspected before")
-    parser.add_option("-v", "--verbose", default=1, action="count",
-                      dest="verbosity", help="Increase verbosity")
-    parser.add_option("-n", "--nothing", default=False, action="store_true",
-                      dest="dry_run", help="Don't do anything, do a dry run")
-    parser.add_option("-d", "--dest", default=["<shell:Pictures>"], action="append",
-                      dest="dest_dirs", help="Destination")
-    parser.add_option("-f", "--forget", default=False, action="store_true",
-                      dest="forget", help="Do no scanning, just forget anything about these sources")
-    (options, sources) = parser.parse_args()
-    if len(sources) > 0:
-        app = wx.App(False)
-        frame = MyFrame(None, "Craig's Media Importer", options, sources)
-        frame.Show(True)
-        app.MainLoop()
+def main(options, sources):
+    app = wx.App(False)
+    frame = MyFrame(None, "Craig's Media Importer", options, sources)
+    frame.Show(True)
+    app.MainLoop()
 
 #vim:sw=4:ts=4
@@ -24,7 +24,17 @@
 __init__ = ['idirs']
 
 import os
+import re
 import platform
+import itertools
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 def compare(val, m):
     if isinstance(m, str):
@@ -34,25 +44,101 @@ def compare(val, m):
 
 IS_WINDOWS = (platform.system() == 'Windows')
 
+def skipped(dirpath, dirnames, visitor, skip_dirs):
+    for skip in skip_dirs:
+        for idx in range(len(dirnames) -1, -1, -1):
+            if compare(dirnames[idx], skip):
+                if visitor:
+                    visitor("skip", (os.path.join(dirpath, dirnames[idx])))
+                del dirnames[idx]
+
+def walk_paths(top, visitor, skip_dirs):
+    for dirpath, dirnames, filenames in os.walk(top):
+        if visitor:
+            visitor("dir", (dirpath, len(filenames), len(dirnames)))
+        for fname in filenames:
+            yield os.path.join(dirpath, fname)
+        skipped(dirpath, dirnames, visitor, skip_dirs)
+
+def walk_entries(top, visitor, skip_dirs):
+    """ Like walk_paths, but yields the directory entries scandir gives us,
+        which already know whether they're files and, on Windows, their stat
+    """
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        files = []
+        dirnames = []
+        dirs = {}
+        try:
+            for entry in scandir(dirpath):
+                if entry.is_dir(follow_symlinks=False):
+                    dirnames.append(entry.name)
+                    dirs[entry.name] = entry
+                else:
+                    files.append(entry)
+        except OSError:
+            # os.walk ignores directories it can't list, so we do too
+            continue
+        if visitor:
+            visitor("dir", (dirpath, len(files), len(dirnames)))
+        for entry in files:
+            yield entry
+        skipped(dirpath, dirnames, visitor, skip_dirs)
+        # Push in reverse so they pop off in order, as os.walk would visit them
+        for name in reversed(dirnames):
+            stack.append(dirs[name].path)
+
 def idirs(dirs, visitor, skip_dirs):
     if dirs is None:
         dirs = []
     if skip_dirs is None:
         skip_dirs = []
+    walk = walk_paths if scandir is None else walk_entries
     for dir in dirs:
         if os.path.isdir(dir):
             if IS_WINDOWS and dir[-1] == ":":
                 dir += "\\"
-            for dirpath, dirnames, filenames in os.walk(os.path.realpath(dir)):
-                if visitor:
-                    visitor("dir", (dirpath, len(filenames), len(dirnames)))
-                for fname in filenames:
-                    yield os.path.join(dirpath, fname)
-                for skip in skip_dirs:
-                    for idx in range(len(dirnames) -1, -1, -1):
-                        if compare(dirnames[idx], skip):
-                            if visitor:
-                                visitor("skip", (os.path.join(dirpath, dirnames[idx])))
-                            del dirnames[idx]
+            for item in walk(os.path.realpath(dir), visitor, skip_dirs):
+                yield item
+
+# Cameras name each frame of a burst after the shot, with a count on the end
+BURST = re.compile(r'^(?P<root>.+?)_BURST\d+(_COVER)?$', re.I)
+
+def name_of(item):
+    return getattr(item, 'name', None) or os.path.basename(item)
+
+def capture_root(fname):
+    """ What fname has in common with the names of the other files its shot made
+    """
+    root = os.path.splitext(fname)[0]
+    m = BURST.match(root)
+    if m:
+        root = m.group('root')
+    return root.lower()
+
+def group_siblings(items, make_group):
+    """ Yields (siblings, group) for each set of items, as idirs yields them,
+        sharing a capture_root in their directory, where group is what
+        make_group(dirpath, names) makes of them, or None if there's only
+        the one. Every file is looked at, so thumbnails and the like count
+        too. idirs yields a directory's files together, so one directory is
+        indexed at a time
+    """
+    for (dirpath, run) in itertools.groupby(items, lambda item: os.path.dirname(getattr(item, 'path', item))):
+        roots = []
+        siblings = {}
+        for item in run:
+            root = capture_root(name_of(item))
+            if root not in siblings:
+                roots.append(root)
+                siblings[root] = []
+            siblings[root].append(item)
+        for root in roots:
+            items = siblings[root]
+            if len(items) > 1:
+                yield (items, make_group(dirpath, [name_of(item) for item in items]))
+            else:
+                yield (items, None)
 
 #vim:sw=4:ts=4
@@ -24,7 +24,7 @@
 #OTHER DEALINGS IN THE SOFTWARE.
 
 if __name__ == "__main__":
-    from frame import main
+    from cli import main
     main()
 
 #vim:sw=4:ts=4
@@ -28,22 +28,50 @@ from __future__ import with_statement
 __init__ = ['Importer']
 
 import os
-import wx
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import re
-from path_metadata import MediaMetadata
+import itertools
+from collections import OrderedDict
+from path_metadata import PathMetadata, MediaMetadata, Capture
 from ShellFolders import parse_dest_dirs
 import time
 from memory import Memory
+from metadata_cache import MetadataCache
+from scheduler import DeviceScheduler
+from copier import CopyEngine, SpaceLedger, device_of
+from dest_index import DestIndex
+from plan import ImportPlan, PlanEntry
+from journal import ImportJournal
+from stats import Stats
+from sinks import SinkClosed
+from workers import WorkerPool
+
+def describe_bytes(n):
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            break
+        n /= 1024.0
+    else:
+        unit = 'TB'
+    return ("%d %s" if unit == 'bytes' else "%.1f %s") % (n, unit)
 
 class Importer(Thread):
     skip_dirs = ['Originals', 'Thumb', re.compile(r'^\..*')]
+    # How many sample digests to look for twins of
+    SAMPLES_KEPT = 16384
+    # How many copies, or how long, between syncing and remembering what's done
+    CHECKPOINT_FILES = 256
+    CHECKPOINT_SECONDS = 2.0
 
-    def __init__(self, frame, sources, opts):
+    def __init__(self, sink, sources, opts):
+        """ sink is told what's going on, with logger(s) and twiddle(mode), from
+            the importer's own thread; frame's WindowSink is one, and ConsoleSink another
+        """
         Thread.__init__(self)
         self.started_at = time.time()
         self.interrupt = Event()
-        self.frame = frame
+        self.sink = sink
+        self.error = None
         self.opts = opts
         self.source_dirs = []
         self.source_files = []
@@ -53,7 +81,19 @@ class Importer(Thread):
             elif os.path.isfile(s):
                 self.source_files.append(os.path.abspath(s))
         self.dest_dirs = parse_dest_dirs(opts.dest_dirs)
-        self.already_imported = Memory()
+        # How long each phase takes, and what it gets through
+        self.stats = Stats()
+        # Reads are spread over the sources' devices, each at its own pace
+        self.scheduler = DeviceScheduler(opts.jobs, opts.source_jobs, self.interrupt)
+        self.already_imported = Memory(self.stats)
+        # Recent sample digests, and the file each was first seen for
+        self.samples = OrderedDict()
+        self.samples_lock = Lock()
+        self.cache = MetadataCache() if opts.use_cache else None
+        if opts.resume:
+            self.__msg("Resuming the last import")
+            self.start()
+            return
         self.__msg("%sImporting media from %s" % (("" if self.dest_dirs else "Not "), ", ".join(self.source_dirs + self.source_files)))
         if self.dest_dirs:
             self.start()
@@ -62,8 +102,8 @@ class Importer(Thread):
         try:
             self.__service_interrupt()
             if self.opts.verbosity >= min_verbosity:
-                wx.CallAfter(self.frame.logger, s)
-        except wx.PyDeadObjectError:
+                self.sink.logger(s)
+        except SinkClosed:
             self.interrupt.set()
 
     def __dmsg(self, s, min_verbosity = 1):
@@ -75,7 +115,10 @@ class Importer(Thread):
     def __twiddle(self, mode):
         self.__service_interrupt()
         if self.opts.verbosity > 1:
-            wx.CallAfter(self.frame.twiddle, mode)
+            try:
+                self.sink.twiddle(mode)
+            except SinkClosed:
+                self.interrupt.set()
 
     def __start(self):
         self.__twiddle(0)
@@ -91,8 +134,7 @@ class Importer(Thread):
           raise UserWarning("Raise Thread Quitting")
 
     def __find_media(self):
-        from idir import idirs
-        import itertools
+        from idir import idirs, group_siblings
 
         def desc_dirs(action, tup):
             if action == "dir":
@@ -113,91 +155,386 @@ class Importer(Thread):
                 (skipped) = tup
                 self.__msg("Skipping dir %s" % (skipped,), 2)
 
-        ret = []
-        self.__start()
-        paths = idirs(self.source_dirs, desc_dirs, Importer.skip_dirs)
-        if self.source_files:
-            paths = itertools.chain(self.source_files, paths)
-        paths = itertools.ifilter(MediaMetadata.has_media_suff, paths)
-        mds = map(lambda path: MediaMetadata(path), paths)
-        if self.opts.skip_already_imported and self.opts.forget is False:
-            mds = itertools.ifilterfalse(lambda md: self.already_imported.known(md.digest()), mds)
-        self.__complete()
-        return mds
+        def is_media(path):
+            self.stats.count('files walked')
+            if not isinstance(path, basestring):
+                # The directory entry already knew whether it's a file or a directory
+                self.stats.count('syscalls avoided', 2)
+            return MediaMetadata.has_media_suff(path, self.opts.raws)
+
+        def metadata((paths, capture)):
+            shot = [MediaMetadata(path, self.cache, capture) for path in paths if is_media(path)]
+            self.stats.count('media files', len(shot))
+            return shot
+
+        def media_on(dirs, files):
+            paths = self.stats.timed_iter('walk', idirs(dirs, desc_dirs, Importer.skip_dirs))
+            if files:
+                paths = itertools.chain(files, paths)
+            # Videos and their stills, raws and their JPEGs, bursts: dated,
+            # and from then on handled, together as one shot
+            captures = group_siblings(paths, Capture)
+            return itertools.ifilter(None, itertools.imap(self.stats.timed('walk', metadata), captures))
+
+        # Each device's files are digested and dated on a pool of its own
+        return self.scheduler.walk(self.source_dirs, self.source_files, media_on, [self.__unknown_media, self.__examine_media])
+
+    def __unknown_media(self, pool, shots):
+        if not self.opts.skip_already_imported or self.opts.forget:
+            return shots
+        # Digest on the pool, then drop anything we've imported before
+        def digest(shot):
+            for md in shot:
+                if md.hexdigest is None:
+                    self.stats.count('bytes read', min(md.size(), 3 * PathMetadata.SAMPLE_SIZE))
+                md.digest()
+
+        digested = pool.imap_unordered(self.stats.timed('digest', digest), shots)
+        imported_before = self.stats.timed('filter', self.__imported_before)
+        unknown = ([md for md in shot if not imported_before(md)] for (shot, none) in digested)
+        return itertools.ifilter(None, unknown)
+
+    def __imported_before(self, md):
+        memory = self.already_imported
+        sample = md.digest()
+        # Every device's files look here, each from a thread of its own
+        with self.samples_lock:
+            twin = self.samples.pop(sample, md.path)
+            self.samples[sample] = twin
+            if len(self.samples) > Importer.SAMPLES_KEPT:
+                # The oldest; twins tend to turn up near each other
+                self.samples.popitem(False)
+        if twin != md.path and PathMetadata(twin).full_digest() != md.full_digest():
+            # Same size and samples but different files; only the whole lot tells them apart
+            memory.mark_ambiguous(sample)
+        if memory.known(sample):
+            if memory.ambiguous(sample):
+                return memory.known(md.full_digest())
+            return True
+        # Only a digest of the first KB was remembered before digests were
+        # sampled, and too many files share that; import it again instead,
+        # where what's already at the destination gets left alone, and
+        # remembered from then on
+        return False
+
+    def __remember(self, md):
+        memory = self.already_imported
+        sample = md.digest()
+        with memory.mutex:
+            memory.remember(sample)
+            if md.full_hexdigest is not None or memory.ambiguous(sample):
+                memory.remember(md.full_digest())
 
-    def __examine_media(self, mds):
+    def __forget(self, md):
+        memory = self.already_imported
+        forgot = False
+        for hexdigest in (md.digest(), md.legacy_digest(), md.full_hexdigest):
+            if hexdigest is not None and memory.known(hexdigest):
+                if not self.opts.dry_run:
+                    memory.forget(hexdigest)
+                forgot = True
+        return forgot
+
+    def __examine_media(self, pool, shots):
         # Now examine their EXIF data, if we can
-        media_details = list(mds)
-        media_count = len(media_details)
-        ret = {}
-        date_count = 0
-        self.__msg("Found %s file%s (Not already inspected), now getting shot date info" % (media_count, ("" if media_count == 1 else "s")))
-        self.__start()
-        for md in media_details:
+        def shot_dates(shot):
+            return [md.get_date() for md in shot]
+
+        for (shot, dates) in pool.imap_unordered(self.stats.timed('date', shot_dates), shots):
             self.__advance()
-            dirpath = md.dirname
-            base = md.basename
-            suff = md.suffix
-            fname = md.path
-            date = md.get_date()
-            if date:
-                date_count += 1
-                l = ret.get(date, [])
-                l.append((dirpath, fname, md))
-                ret[date] = l
-        self.__complete()
-        return (ret, date_count)
+            dated = [(date, md) for (md, date) in zip(shot, dates) if date]
+            if dated:
+                yield dated
+
+    def __date_dirs(self, date):
+        (year, month, day) = date
+        YY = '%02d' % year
+        date_dir = '%s_%02d_%02d' % (YY, month, day)
+        return [os.path.join(dest_dir, YY, date_dir) for dest_dir in self.dest_dirs]
+
+    def __describe_copies(self, n, count):
+        def visitor(action, tup):
+            (md, dest) = tup
+            kind = md.kind()
+            src = md.path
+            mention_dest = (" to %s" % (dest,)) if self.opts.verbosity > 1 else ""
+            if action == "import":
+                self.__dmsg("Importing %s [file %d of %d] %s%s" % (kind, n, count, src, mention_dest))
+            elif action == "already":
+                self.__msg("%s [file %d of %d] %s already imported%s" % (kind, n, count, src, mention_dest))
+            elif action == "progress":
+                (done, total, rate, eta) = dest
+                self.__msg("  [file %d of %d] %s of %s at %s/s%s" % (n, count, describe_bytes(done), describe_bytes(total), describe_bytes(rate),
+                                                                   ("" if eta is None else ", %d seconds to go" % (eta,))))
+            #elif action == "mkdir":
+                #self.__dmsg("Creating directory %s" % (dest,), 2)
+            #elif action == "!mkdir":
+                #self.__msg("Directory %s already exists" % (dest,), 2)
+        return visitor
+
+    def __measure(self, index):
+        """ How many media files there may be to import, and how much room
+            the ones certain to be copied need, as (dest_dir, size) pairs: a
+            lower bound, from what the cache already knows of their digests
+            and dates and what's at the destinations.  Walks each source
+            device at once, reading nothing but directories.
+        """
+        from idir import idirs
+        if self.cache is None:
+            # Nothing's known for certain without reading the files
+            return (0, [])
+        memory = self.already_imported
+        skip = self.opts.skip_already_imported
+        # Linked destinations on the source's filesystem take no room
+        shares = self.opts.link != 'copy'
+        devices = {}
+        lock = Lock()
+
+        def measure((dev, dirs, files)):
+            count = 0
+            needs = {}
+            for path in itertools.chain(files, idirs(dirs, None, Importer.skip_dirs)):
+                self.__service_interrupt()
+                if not MediaMetadata.has_media_suff(path, self.opts.raws):
+                    continue
+                md = MediaMetadata(path, self.cache)
+                if skip and md.hexdigest is not None and memory.known(md.hexdigest) and not memory.ambiguous(md.hexdigest):
+                    continue
+                count += 1
+                if md.date is None or (skip and (md.hexdigest is None or memory.ambiguous(md.hexdigest))):
+                    # It may yet turn out to have been imported, or be undated
+                    continue
+                for dest_dir in self.__date_dirs(md.date):
+                    with lock:
+                        if dest_dir not in devices:
+                            devices[dest_dir] = device_of(dest_dir)
+                        dest_dev = devices[dest_dir]
+                    if (shares and dest_dev == dev) or index.exists(dest_dir, md.fname):
+                        continue
+                    # Keyed by name too, so a file on two sources counts once
+                    needs[(dest_dir, md.fname)] = md.size()
+            yield (count, needs)
+
+        count = 0
+        needs = {}
+        streams = [measure(part) for part in self.scheduler.by_device(self.source_dirs, self.source_files)]
+        for (n, more) in WorkerPool(1, self.interrupt).merge(streams):
+            count += n
+            needs.update(more)
+        return (count, [(dest_dir, size) for ((dest_dir, fname), size) in needs.items()])
+
+    def __preflight(self, ledger, needs):
+        short = ledger.preflight(needs)
+        for (dest, needed, available) in short:
+            self.__msg("Importing needs %s on the disk holding %s, but only %s is free" % (describe_bytes(needed), dest, describe_bytes(available)))
+        if short:
+            raise UserWarning("Not enough disk space to import all of this")
+
+    def __plan(self, media, days, plan):
+        # Each shot's planned as soon as its dates are known, and copied right after
+        for dated in media:
+            shot = []
+            for (date, src_md) in dated:
+                days[date] = days.get(date, 0) + 1
+                shot.append(PlanEntry(src_md, date, self.__date_dirs(date)))
+            if plan is not None:
+                plan.entries.extend(shot)
+            yield shot
+
+    def __show_plan(self, shots, count, index):
+        n = 0
+        for shot in shots:
+            for entry in shot:
+                n += 1
+                visitor = self.__describe_copies(n, max(n, count))
+                for dest_dir in entry.dest_dirs:
+                    dest = os.path.join(dest_dir, entry.md.fname)
+                    visitor("already" if index.exists(dest_dir, entry.md.fname) else "import", (entry.md, dest))
+
+    def __execute(self, shots, count, ledger, index, journal, planned):
+        link = None if self.opts.link == 'copy' else self.opts.link
+        engine = CopyEngine(self.opts.copy_jobs, self.opts.device_jobs, self.interrupt, self.opts.verify,
+                            ledger, index, self.opts.fsync, link, planned)
+        owners = {}
+
+        def jobs():
+            # A shot's files are one job, so they're copied, remembered and
+            # journalled together
+            n = 0
+            for shot in shots:
+                if not planned:
+                    journal.add(shot)
+                job = []
+                for entry in shot:
+                    n += 1
+                    job.append((entry.md, entry.dest_dirs, self.__describe_copies(n, max(n, count))))
+                owners[id(job)] = shot
+                yield job
+
+        # Copies finish in whatever order, so every so often sync the
+        # directories of the ones that have, and only then remember them
+        finished = []
+        copied_mds = []
+        checked = time.time()
+        with self.already_imported.batch():
+            try:
+                for (job, copied) in self.stats.timed_iter('copy', engine.run(jobs())):
+                    finished.extend(owners.pop(id(job)))
+                    for ((src_md, dests, visitor), did) in zip(job, copied):
+                        self.__advance()
+                        if True in did:
+                            # The devices it goes to share a read of the source
+                            self.stats.count('files copied')
+                            self.stats.count('bytes read', src_md.size())
+                            self.stats.count('bytes written', did.count(True) * src_md.size())
+                            copied_mds.append(src_md)
+                        elif self.__already_there(src_md, dests, index):
+                            # Imported by an older version, or by hand; no
+                            # need to look at it again next time
+                            copied_mds.append(src_md)
+                    if len(finished) >= Importer.CHECKPOINT_FILES or time.time() - checked >= Importer.CHECKPOINT_SECONDS:
+                        self.__checkpoint(finished, copied_mds, journal)
+                        finished = []
+                        copied_mds = []
+                        checked = time.time()
+            finally:
+                # Whatever finished is done, even if the rest went wrong
+                self.__checkpoint(finished, copied_mds, journal)
+
+    def __already_there(self, src_md, dest_dirs, index):
+        # The same name and size at every destination
+        for dest_dir in dest_dirs:
+            if index.size(dest_dir, src_md.fname) != src_md.size():
+                return False
+        return True
+
+    def __checkpoint(self, finished, copied_mds, journal):
+        from copier import sync_dir
+        if copied_mds and self.opts.sync:
+            dirs = set()
+            for entry in finished:
+                for dest_dir in entry.dest_dirs:
+                    dirs.add(dest_dir)
+                    # It may be new itself
+                    dirs.add(os.path.dirname(dest_dir))
+            for dest_dir in sorted(dirs, reverse=True):
+                if os.path.isdir(dest_dir):
+                    sync_dir(dest_dir)
+        # Only now are they safe to remember
+        for src_md in copied_mds:
+            self.__remember(src_md)
+        self.already_imported.commit()
+        if finished:
+            journal.done(finished)
 
     def __runner(self):
-        (media, date_count) = self.__examine_media(self.__find_media())
-        self.__msg("Found shot date info of %s file%s" % (date_count, ("" if date_count == 1 else "s")))
-        dates = media.keys()
+        journal = ImportJournal()
+        days = {}
+        if self.opts.resume:
+            if not journal.resume():
+                raise UserWarning("There's no interrupted import to resume")
+            (plan, finished) = journal.pending(self.cache)
+            # The card may have been swapped or tidied up since
+            gone = [entry for entry in plan if entry.size is None]
+            for entry in gone:
+                self.__msg("%s has gone, so it can't be imported" % (entry.path,))
+            if gone:
+                plan = ImportPlan([entry for entry in plan if entry.size is not None])
+            for entry in plan:
+                days[entry.date] = days.get(entry.date, 0) + 1
+            self.__msg("Resuming an interrupted import, %d file%s done and %d to go" % (finished, ("" if finished == 1 else "s"), len(plan)))
+            self.__msg("Anything it hadn't found yet gets picked up by importing again")
+            if not self.opts.dry_run:
+                index = DestIndex()
+                needs = [(dest_dir, size) for (dest_dir, fname, size) in plan.needs() if not index.exists(dest_dir, fname)]
+                self.__import(plan.shots(), len(plan), journal, index, needs, True)
+            else:
+                self.__show_plan(plan.shots(), len(plan), DestIndex())
+            self.__finished(days)
+            return
+
+        self.__msg("Scanning for media (Not already inspected) and getting shot date info")
+        self.__start()
+        # Each stage only holds a few files at a time
+        media = self.__find_media()
+        if self.opts.forget:
+            for (date, src_md) in itertools.chain.from_iterable(media):
+                days[date] = days.get(date, 0) + 1
+                if self.__forget(src_md):
+                    self.__dmsg("Forgetting %s" % (src_md.path,))
+            self.already_imported.commit()
+            self.__complete()
+            date_count = sum(days.values())
+            self.__msg("Found shot date info of %s file%s" % (date_count, ("" if date_count == 1 else "s")))
+        else:
+            # What's sure to need copying can be checked for space before
+            # anything's dated; the rest reserves its own as it goes
+            index = DestIndex()
+            (count, needs) = self.__measure(index)
+            plan = ImportPlan() if self.opts.plan_file else None
+            shots = self.__plan(media, days, plan)
+            if self.opts.dry_run:
+                self.__show_plan(shots, count, index)
+                self.__complete()
+            else:
+                # If this gets interrupted, --resume can pick up from here
+                journal.start()
+                self.__import(shots, count, journal, index, needs, False)
+            date_count = sum(days.values())
+            self.__msg("Found shot date info of %s file%s" % (date_count, ("" if date_count == 1 else "s")))
+            if plan is not None:
+                plan.sort()
+                plan.save(self.opts.plan_file)
+                self.__msg("Saved the import plan to %s" % (self.opts.plan_file,))
+        self.__finished(days)
+
+    def __import(self, shots, count, journal, index, needs, planned):
+        ledger = SpaceLedger()
+        try:
+            self.__preflight(ledger, needs)
+            self.__start()
+            self.__execute(shots, count, ledger, index, journal, planned)
+        finally:
+            journal.close()
+        # Each lookup answered from a listing would have been a stat
+        self.stats.count('destination listings', index.listings)
+        self.stats.count('syscalls avoided', index.lookups)
+        self.__complete()
+        journal.finish()
+
+    def __finished(self, days):
+        dates = days.keys()
         dates.sort()
-        n = 0
         for date in dates:
-            (year, month, day) = date
-            files = media[date]
-            YY = '%02d' % year
-            date_dir = '%s_%02d_%02d' % (YY, month, day)
-
-            if self.opts.forget:
-                for (dirpath, fname, src_md) in files:
-                    hexdigest = src_md.digest()
-                    if self.already_imported.known(hexdigest):
-                        self.__dmsg("Forgetting %s" % (os.path.join(dirpath, fname),))
-                        if not self.opts.dry_run:
-                            self.already_imported.forget(hexdigest)
-                self.already_imported.commit()
-            else:
-                def desc_copies(action, tup):
-                    (md, dest) = tup
-                    kind = md.kind()
-                    src = md.path
-                    mention_dest = (" to %s" % (dest,)) if self.opts.verbosity > 1 else ""
-                    if action == "import":
-                        self.__dmsg("Importing %s [file %d of %d] %s%s" % (kind, n, date_count, src, mention_dest))
-                    elif action == "already":
-                        self.__msg("%s [file %d of %d] %s already imported%s" % (kind, n, date_count, src, mention_dest))
-                    #elif action == "mkdir":
-                        #self.__dmsg("Creating directory %s" % (dest,), 2)
-                    #elif action == "!mkdir":
-                        #self.__msg("Directory %s already exists" % (dest,), 2)
-
-                for (dirpath, fname, src_md) in files:
-                    n += 1
-                    for dest_dir in self.dest_dirs:
-                        d = os.path.join(dest_dir, YY, date_dir)
-                        if src_md.copy_to(d, self.opts.dry_run, desc_copies):
-                            self.already_imported.remember(src_md.digest())
+            self.__msg("%04d-%02d-%02d: %d file%s" % (date + (days[date], ("" if days[date] == 1 else "s"))), 2)
         tdelta = time.time() - self.started_at
         self.__msg("All done in %.01f second%s!" % (tdelta, "" if tdelta == 1 else "s"))
 
     def run(self):
         from traceback import print_exc
         try:
-            self.__runner()
-        except Exception, e:
-            print_exc()
-            print "Exception %s" % (str(e),)
+            try:
+                if self.opts.cprofile:
+                    # Only this thread's time; the pools' threads aren't profiled
+                    import cProfile
+                    profiler = cProfile.Profile()
+                    try:
+                        profiler.runcall(self.__runner)
+                    finally:
+                        profiler.dump_stats(self.opts.cprofile)
+                else:
+                    self.__runner()
+            except Exception, e:
+                self.error = e
+                print_exc()
+                print "Exception %s" % (str(e),)
+        finally:
+            self.already_imported.commit()
+            if self.cache is not None:
+                self.stats.count('cache hits', self.cache.hits)
+                self.stats.count('cache misses', self.cache.misses)
+                self.cache.close()
+            if self.opts.profile:
+                self.stats.save(self.opts.profile)
 
 #vim:sw=4:ts=4
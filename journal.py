@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['ImportJournal']
+
+import os
+import glob
+import json
+import time
+from threading import Lock
+from memory import FileLock
+from plan import ImportPlan, PlanEntry
+
+class ImportJournal(object):
+    """ The plan of an import under way, added to as its files are found,
+        and which of its entries are done, so an interrupted import can
+        carry on without scanning again.  Each import has one of its own,
+        locked for as long as it's under way, so imports running at the
+        same time keep out of each other's.
+    """
+    VERSION = 2
+
+    def __init__(self, base = None):
+        if base is None:
+            base = os.path.join(os.path.dirname(__file__), '.import_journal')
+        self.base = base
+        self.path = self.plan_path = None
+        self.held = None
+        self.lock = Lock()
+        self.plan_file = None
+        self.count = 0
+
+    def __use(self, path, wait):
+        # Take path for ours, if no running import has it
+        held = FileLock(path + '.lock')
+        if not held.acquire(wait):
+            return False
+        self.held = held
+        self.path = path
+        self.plan_path = path + '.plan'
+        return True
+
+    def resume(self):
+        """ Takes up the latest journal of an import that stopped part way.
+            Returns whether there was one.
+        """
+        plans = [(os.path.getmtime(plan_path), plan_path) for plan_path in glob.glob(self.base + '-*.plan')]
+        for (mtime, plan_path) in sorted(plans, reverse=True):
+            if self.__use(plan_path[:-len('.plan')], False):
+                if os.path.isfile(self.plan_path):
+                    return True
+                # Finished while we were looking
+                self.__release()
+        return False
+
+    def start(self):
+        path = stamp = '%s-%d-%d' % (self.base, int(time.time() * 1000), os.getpid())
+        # Not one this process left behind a moment ago
+        n = 0
+        while os.path.exists(path + '.plan'):
+            n += 1
+            path = '%s-%d' % (stamp, n)
+        self.__use(path, True)
+        # Write the header aside first, so there's never a half-written one
+        tmp = self.plan_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps({'version': ImportJournal.VERSION}) + '\n')
+        if os.path.exists(self.plan_path):
+            os.remove(self.plan_path)
+        os.rename(tmp, self.plan_path)
+        open(self.path, 'wb').close()
+        self.plan_file = open(self.plan_path, 'ab')
+        self.count = 0
+
+    def add(self, entries):
+        """ Numbers entries, one shot's, and appends them to the plan
+        """
+        with self.lock:
+            for entry in entries:
+                entry.number = self.count
+                entry.shot = entries[0].number
+                self.count += 1
+                self.plan_file.write(json.dumps(entry.to_dict()) + '\n')
+            self.plan_file.flush()
+
+    def done(self, entries):
+        with self.lock:
+            if self.plan_file is not None:
+                # They can't be done before they're planned
+                os.fsync(self.plan_file.fileno())
+            with open(self.path, 'ab') as f:
+                f.write(''.join(['%d\n' % (entry.number,) for entry in entries]))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self, cache = None):
+        """ The plan, less what's been done
+        """
+        entries = []
+        with open(self.plan_path, 'rb') as f:
+            header = f.readline()
+            if not header.endswith('\n') or json.loads(header).get('version', None) != ImportJournal.VERSION:
+                raise UserWarning("%s isn't an import journal this version understands" % (self.plan_path,))
+            for line in f:
+                # A torn last line from a crash is missing its newline; skip it
+                if line.endswith('\n'):
+                    entry = PlanEntry.from_dict(json.loads(line), cache)
+                    entry.number = len(entries)
+                    entries.append(entry)
+        finished = set()
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        finished.add(int(line))
+        return (ImportPlan([entry for entry in entries if entry.number not in finished]), len(finished))
+
+    def close(self):
+        with self.lock:
+            if self.plan_file is not None:
+                self.plan_file.close()
+                self.plan_file = None
+
+    def __release(self):
+        if self.held is not None:
+            self.held.release()
+            self.held = None
+
+    def finish(self):
+        self.close()
+        for path in (self.path, self.plan_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.__release()
+        if os.path.exists(self.path + '.lock'):
+            os.remove(self.path + '.lock')
+
+#vim:sw=4:ts=4
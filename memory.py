@@ -23,37 +23,236 @@
 #FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 #OTHER DEALINGS IN THE SOFTWARE.
 
+from __future__ import with_statement
+
+__init__ = ['FileLock', 'Memory']
+
 import os
+import errno
+import time
+import platform
+import binascii
+import hashlib
 import cPickle as pickle
-from __future__ import with_statement
+from contextlib import contextmanager
+from threading import RLock
+from digest_index import DigestIndex
+
+IS_WINDOWS = (platform.system() == 'Windows')
+if IS_WINDOWS:
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock(object):
+    """ An exclusive lock held on a file, for as long as a with block runs,
+        or from acquire() to release()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def acquire(self, wait = True):
+        """ Without wait, gives up at once if someone else holds it.
+            Returns whether it got it.
+        """
+        self.f = open(self.path, 'a+b')
+        try:
+            if IS_WINDOWS:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except (IOError, OSError), e:
+            self.f.close()
+            self.f = None
+            if wait or e.errno not in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                raise
+            return False
+        return True
+
+    def release(self):
+        try:
+            if IS_WINDOWS:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
 
 class Memory:
     VERSION = 1
+    # Journal entries to gather up before appending them in one go
+    GROUP_SIZE = 64
+    # Journal entries to allow before folding them into the index
+    COMPACT_AT = 4096
+
+    def __init__(self, stats = None, handkerchief = None):
+        self.stats = stats
+        if handkerchief is None:
+            handkerchief = os.path.join(os.path.dirname(__file__), '.already_imported')
+        self.handkerchief = handkerchief
+        self.index_path = self.handkerchief + '.idx'
+        self.journal = self.handkerchief + '.journal'
+        self.lock = FileLock(self.handkerchief + '.lock')
+        self.pending = []
+        self.batches = 0
+        # The importer's stages call in from more than one thread
+        self.mutex = RLock()
+        with self.lock:
+            if os.path.isfile(self.handkerchief) and not os.path.isfile(self.index_path):
+                self.__migrate()
+            self.index = DigestIndex(self.index_path)
+            (self.added, self.removed, self.journalled) = self.__load_journal()
+
+    def __migrate(self):
+        # One-off conversion of the old pickled set of hex digests
+        remembered = set()
+        with open(self.handkerchief, 'rb') as f:
+            data = pickle.load(f)
+            if isinstance(data, set):
+                remembered = data
+            elif isinstance(data, list):
+                if data[0] == Memory.VERSION:
+                    remembered = data[1]
+        digests = sorted([binascii.unhexlify(h) for h in remembered])
+        self.__replace_index(digests, len(digests))
+        os.rename(self.handkerchief, self.handkerchief + '.old')
 
-    def __init__(self):
-        self.handkerchief = os.path.join(os.path.dirname(__file__), '.already_imported')
-        self.remembered = set()
-        if os.path.isfile(self.handkerchief):
-            with open(self.handkerchief, 'rb') as f:
-                data = pickle.load(f)
-                if isinstance(data, set):
-                    self.remembered = data
-                elif isinstance(data, list):
-                    if data[0] == Memory.VERSION:
-                        self.remembered = data[1]
+    def __load_journal(self):
+        added = set()
+        removed = set()
+        journalled = 0
+        if os.path.isfile(self.journal):
+            with open(self.journal, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    # A torn last line from a crash is missing its newline; skip it
+                    if len(line) != 41:
+                        continue
+                    digest = binascii.unhexlify(line[1:])
+                    if line[0] == '+':
+                        added.add(digest)
+                        removed.discard(digest)
+                    elif line[0] == '-':
+                        removed.add(digest)
+                        added.discard(digest)
+                    journalled += 1
+        return (added, removed, journalled)
+
+    def __known(self, digest):
+        if digest in self.added:
+            return True
+        if digest in self.removed:
+            return False
+        return digest in self.index
 
     def remember(self, hexdigest):
-        if hexdigest not in self.remembered:
-            self.remembered.add(hexdigest)
-            self.commit()
+        with self.mutex:
+            digest = binascii.unhexlify(hexdigest)
+            if not self.__known(digest):
+                self.added.add(digest)
+                self.removed.discard(digest)
+                self.pending.append('+' + hexdigest)
+                if len(self.pending) >= Memory.GROUP_SIZE and not self.batches:
+                    self.commit()
 
     def known(self, hexdigest):
-        ret = hexdigest in self.remembered
-        return ret
+        with self.mutex:
+            return self.__known(binascii.unhexlify(hexdigest))
 
     def forget(self, hexdigest):
-        self.remembered.remove(hexdigest)
+        with self.mutex:
+            digest = binascii.unhexlify(hexdigest)
+            if not self.__known(digest):
+                raise KeyError(hexdigest)
+            self.added.discard(digest)
+            self.removed.add(digest)
+            self.pending.append('-' + hexdigest)
+
+    @staticmethod
+    def ambiguous_key(hexdigest):
+        # Kept among the digests themselves, as the digest of something no file starts with
+        return hashlib.sha1('ambiguous:' + binascii.unhexlify(hexdigest)).hexdigest()
+
+    def mark_ambiguous(self, hexdigest):
+        """ Note that more than one file has this sampled digest, so they
+            have to be told apart by their full digests from now on
+        """
+        self.remember(Memory.ambiguous_key(hexdigest))
+
+    def ambiguous(self, hexdigest):
+        return self.known(Memory.ambiguous_key(hexdigest))
+
+    @contextmanager
+    def batch(self):
+        """ Hold on to everything remembered in the with block and commit
+            it all in one go at the end
+        """
+        with self.mutex:
+            self.batches += 1
+        try:
+            yield self
+        finally:
+            with self.mutex:
+                self.batches -= 1
+                if not self.batches:
+                    self.commit()
 
     def commit(self):
-        with open(self.handkerchief, 'wb') as f:
-            pickle.dump([Memory.VERSION, self.remembered], f)
+        with self.mutex:
+            if not self.pending:
+                return
+            started = time.time()
+            with self.lock:
+                with open(self.journal, 'ab') as f:
+                    f.write(''.join(['%s\n' % (entry,) for entry in self.pending]))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.journalled += len(self.pending)
+                committed = len(self.pending)
+                self.pending = []
+                if self.journalled >= Memory.COMPACT_AT:
+                    self.__compact()
+            if self.stats is not None:
+                self.stats.add_time('memory commit', time.time() - started)
+                self.stats.count('journal entries', committed)
+
+    def __replace_index(self, digests, capacity):
+        tmp = self.index_path + '.tmp'
+        DigestIndex.write(tmp, digests, capacity)
+        if IS_WINDOWS and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.rename(tmp, self.index_path)
+
+    def __compact(self):
+        # Other importers may have added to the journal, so start from what's on disk
+        (added, removed, journalled) = self.__load_journal()
+        old = DigestIndex(self.index_path)
+        try:
+            added = sorted(added)
+            merged = DigestIndex.merge(old, added, removed)
+            tmp = self.index_path + '.tmp'
+            DigestIndex.write(tmp, merged, len(old) + len(added))
+        finally:
+            old.close()
+        # Windows won't replace a file that's still mapped
+        self.index.close()
+        if IS_WINDOWS and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.rename(tmp, self.index_path)
+        open(self.journal, 'wb').close()
+        self.index = DigestIndex(self.index_path)
+        self.added = set()
+        self.removed = set()
+        self.journalled = 0
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['MetadataCache']
+
+import os
+import stat
+import time
+import sqlite3
+from threading import Lock
+
+class MetadataCache(object):
+    """ Remembers each file's digest, shot date and kind between runs,
+        for as long as its (size, mtime, inode) stay the same.
+    """
+    VERSION = 2
+    # Entries not seen for this long are thrown away
+    MAX_AGE = 180 * 24 * 60 * 60
+    # Writes to gather up before sending them to the database
+    BATCH_SIZE = 256
+
+    def __init__(self, path = None):
+        if path is None:
+            path = os.path.join(os.path.dirname(__file__), '.metadata_cache')
+        self.path = path
+        self.lock = Lock()
+        self.now = int(time.time())
+        self.pending = {}
+        self.stale = []
+        self.hits = self.misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != MetadataCache.VERSION:
+            # What's in there was worked out differently, so start again
+            self.db.execute("DROP TABLE IF EXISTS media")
+            self.db.execute("PRAGMA user_version = %d" % (MetadataCache.VERSION,))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS media (
+                             path TEXT PRIMARY KEY,
+                             size INTEGER, mtime INTEGER, inode INTEGER,
+                             digest TEXT, legacy_digest TEXT, full_digest TEXT,
+                             date TEXT, kind TEXT, seen INTEGER)""")
+        self.db.execute("DELETE FROM media WHERE seen < ?", (self.now - MetadataCache.MAX_AGE,))
+        self.db.commit()
+
+    @staticmethod
+    def identity(st):
+        return (st[stat.ST_SIZE], int(st[stat.ST_MTIME]), st[stat.ST_INO])
+
+    def fill(self, md, st):
+        """ Give md whatever is known about it, if st says it hasn't changed
+        """
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, inode, digest, legacy_digest, full_digest, date FROM media WHERE path = ?", (md.path,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False
+        if tuple(row[0:3]) != MetadataCache.identity(st):
+            with self.lock:
+                self.stale.append(md.path)
+            self.misses += 1
+            return False
+        (digest, legacy_digest, full_digest, date) = row[3:7]
+        if digest and legacy_digest:
+            md.hexdigest = str(digest)
+            md.legacy_hexdigest = str(legacy_digest)
+        if full_digest:
+            md.full_hexdigest = str(full_digest)
+        if date:
+            md.date = tuple([int(p) for p in date.split('-')])
+        self.hits += 1
+        self.store(md)
+        return True
+
+    def store(self, md):
+        if md.stat is None:
+            return
+        (size, mtime, inode) = MetadataCache.identity(md.stat)
+        date = None if md.date is None else '%d-%d-%d' % md.date
+        with self.lock:
+            self.pending[md.path] = (md.path, size, mtime, inode, md.hexdigest, md.legacy_hexdigest, md.full_hexdigest, date, md.kind(), self.now)
+            if len(self.pending) < MetadataCache.BATCH_SIZE:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.stale:
+                self.db.executemany("DELETE FROM media WHERE path = ?", [(p,) for p in self.stale])
+                self.stale = []
+            if self.pending:
+                self.db.executemany("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending.values())
+                self.pending = {}
+            self.db.commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.db.close()
+
+#vim:sw=4:ts=4
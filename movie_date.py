@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['creation_date', 'MalformedMovie']
+
+import os
+import struct
+import time
+
+# QuickTime and MP4 count seconds from the start of 1904, Unix from 1970
+EPOCH_1904 = 2082844800
+# A moov atom nested inside something else isn't what we want, so only walk
+# this many atoms at each level before giving up
+MAX_ATOMS = 1024
+
+class MalformedMovie(ValueError):
+    pass
+
+def read_exactly(f, n):
+    data = f.read(n)
+    if len(data) != n:
+        raise MalformedMovie("Truncated atom")
+    return data
+
+def find_atom(f, start, end, wanted):
+    """ Return the (data start, data end) of the first atom called wanted
+        between offsets start and end, seeking from header to header
+    """
+    at = start
+    for i in range(MAX_ATOMS):
+        if at + 8 > end:
+            return None
+        f.seek(at)
+        (size, kind) = struct.unpack('>I4s', read_exactly(f, 8))
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack('>Q', read_exactly(f, 8))
+            header = 16
+        elif size == 0:
+            # Runs to the end of the file
+            size = end - at
+        if size < header:
+            raise MalformedMovie("Atom %r is too small" % (kind,))
+        if kind == wanted:
+            return (at + header, min(at + size, end))
+        at += size
+    return None
+
+def creation_date(f):
+    """ The (year, month, day) the movie open as f was made, from its
+        moov/mvhd atom, or None if it doesn't say
+    """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    moov = find_atom(f, 0, end, 'moov')
+    if moov is None:
+        return None
+    mvhd = find_atom(f, moov[0], moov[1], 'mvhd')
+    if mvhd is None:
+        return None
+    f.seek(mvhd[0])
+    (version,) = struct.unpack('>B3x', read_exactly(f, 4))
+    if version == 0:
+        (created,) = struct.unpack('>I', read_exactly(f, 4))
+    elif version == 1:
+        (created,) = struct.unpack('>Q', read_exactly(f, 8))
+    else:
+        raise MalformedMovie("Unknown mvhd version %d" % (version,))
+    if created <= EPOCH_1904:
+        # Unset, or before 1970 which no camera of ours could manage
+        return None
+    try:
+        t = time.localtime(created - EPOCH_1904)
+    except (ValueError, OverflowError):
+        raise MalformedMovie("Silly creation time %d" % (created,))
+    return (t.tm_year, t.tm_mon, t.tm_mday)
+
+#vim:sw=4:ts=4
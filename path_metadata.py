@@ -25,47 +25,64 @@
 
 from __future__ import with_statement
 
-__init__ = ['PathMetadata', 'MediaMetadata']
+__init__ = ['PathMetadata', 'MediaMetadata', 'Capture']
 
 import os
 import stat
 import platform
 import time
-import EXIF
+from exif_date import date_time_original, MalformedExif
+from movie_date import creation_date, MalformedMovie
+from probe import Probe
 import ctypes
 import hashlib
 import re
 import string
-import shutil
+from threading import Lock
 
 class PathMetadata(object):
     IS_WINDOWS = (platform.system() == 'Windows')
+    # What digests used to cover, still needed to recognise what's in Memory from then
     READ_CAP_FOR_DIGEST = 1024
+    # How much of the head, middle and tail of a file its digest covers
+    SAMPLE_SIZE = 8192
+    FULL_DIGEST_CHUNK = 1024 * 1024
 
     def __init__(self, path):
+        # path may also be a directory entry from idirs, which already knows its type
+        self.entry = None if isinstance(path, basestring) or path is None else path
+        if self.entry is not None:
+            path = self.entry.path
         self.path = path
         if path is not None:
-            self.exists = os.path.exists(path)
             self.dirname = os.path.dirname(path)
             self.fname = os.path.basename(path)
             self.basename, self.suffix = os.path.splitext(self.fname)
-        self.date = self.hexdigest = self.is_dir = self.is_file = self.stat = self.mtime = self.exif_tags = None
+        self.date = self.hexdigest = self.legacy_hexdigest = self.full_hexdigest = self.is_dir = self.is_file = self.stat = self.mtime = self.exif_tags = None
+        # What of the file's head digesting it read, until its date's been read from it too
+        self.head = None
         self.__isreadable()
 
     def __isreadable(self):
         if self.path is None:
             return
-        self.is_file = os.path.isfile(self.path)
-        self.is_dir = os.path.isdir(self.path)
-        self.is_readable = (self.is_file or self.is_dir)
+        if self.entry is not None:
+            self.is_file = self.entry.is_file()
+            self.is_dir = self.entry.is_dir()
+        else:
+            self.is_file = os.path.isfile(self.path)
+            self.is_dir = os.path.isdir(self.path)
+        self.is_readable = self.exists = (self.is_file or self.is_dir)
 
     def __stat(self, reload):
         if reload:
+            # Anything the entry knew may be out of date now
+            self.entry = None
             if not self.is_readable:
                 self.__isreadable()
             self.stat = None
         if self.is_readable and self.stat is None:
-            self.stat = os.stat(self.path)
+            self.stat = os.stat(self.path) if self.entry is None else self.entry.stat()
 
     def size(self, reload = False):
         self.__stat(reload)
@@ -93,109 +110,341 @@ class PathMetadata(object):
 
     def __read_hexdigest(self, reload = False):
         if self.is_file and (reload or self.hexdigest is None):
-            m = hashlib.sha1()
+            sample_size = PathMetadata.SAMPLE_SIZE
+            size = self.size(reload)
+            # Files differing in size can't be the same, so that goes in first
+            m = hashlib.sha1('%d\n' % (size,))
             with open(self.path, 'rb') as f:
-                m.update(f.read(PathMetadata.READ_CAP_FOR_DIGEST))
+                # Enough for the date to be read from too, usually
+                self.head = Probe.read_head(f, self.path)
+                head = self.head[:sample_size]
+                m.update(head)
+                if size > 3 * sample_size:
+                    f.seek((size - sample_size) // 2)
+                    m.update(f.read(sample_size))
+                    f.seek(size - sample_size)
+                    m.update(f.read(sample_size))
+                else:
+                    # Small enough to take the lot
+                    m.update(self.head[sample_size:])
+                    m.update(f.read())
             self.hexdigest = m.hexdigest()
+            self.legacy_hexdigest = hashlib.sha1(head[:PathMetadata.READ_CAP_FOR_DIGEST]).hexdigest()
 
     def digest(self, reload = False):
+        """ A digest of the file's size and samples of its head, middle and tail
+        """
         self.__read_hexdigest(reload)
         return self.hexdigest
 
-    def copy_to(self, dest_dir, dry_run = False, visitor = None):
-        if not os.path.isdir(dest_dir):
-            visitor("mkdir", (self, dest_dir))
-            if not dry_run:
-                os.makedirs(dest_dir)
-        else:
-            visitor("!mkdir", (self, dest_dir))
-        dest = os.path.join(dest_dir, self.fname)
-        dest_md = PathMetadata(dest)
-        dest_len = dest_md.size()
-        # If it's not there TO START WITH
-        kind = self.kind()
-        copied = False
-        if dest_len is None:
-            if visitor:
-                visitor("import", (self, dest))
-            if not dry_run:
-                src_len = self.size()
-                limit = 0
-                while src_len != dest_len:
-                    if limit > 10: # completely arbitrary re-try limit
-                        raise UserWarning("Failed to copy %s too many times" % (self.path,))
-                    # First entry to this loop, the dest is missing
-                    # But when we loop, it'll be present and unequal to source
-                    if dest_len is not None:
-                        # So delete the fragment
+    def legacy_digest(self, reload = False):
+        """ The digest of the first READ_CAP_FOR_DIGEST bytes, as used to be remembered
+        """
+        if reload or self.legacy_hexdigest is None:
+            self.__read_hexdigest(True)
+        return self.legacy_hexdigest
+
+    def full_digest(self, reload = False):
+        """ A digest of the whole file, for when two samples collide
+        """
+        if self.is_file and (reload or self.full_hexdigest is None):
+            m = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                while True:
+                    buf = f.read(PathMetadata.FULL_DIGEST_CHUNK)
+                    if not buf:
+                        break
+                    m.update(buf)
+            self.full_hexdigest = m.hexdigest()
+        return self.full_hexdigest
+
+    def copy_to(self, dest_dir, dry_run = False, visitor = None, verify = False, interrupt = None, ledger = None, index = None, sync = False, link = None):
+        return self.copy_to_all([dest_dir], dry_run, visitor, verify, interrupt, ledger, index, sync, link)[0]
+
+    def copy_to_all(self, dest_dirs, dry_run = False, visitor = None, verify = False, interrupt = None, ledger = None, index = None, sync = False, link = None, source = None, partial = False):
+        """ Copy to every one of dest_dirs, reading the source only once.
+            With verify, the source is hashed as it's copied and must match
+            its full digest if that's already known, and becomes it if not,
+            and each copy is read back and compared with the source; a copy
+            that differs is carried on from its first wrong byte.
+            Setting interrupt stops the copy within a chunk, removing what
+            was written so far.  Space is reserved in ledger, a SpaceLedger
+            shared between copies, before each one, and what's already at
+            the destinations is looked up in index, a DestIndex.  With sync
+            the copies' contents are flushed to disk; syncing their
+            directories is up to the caller.  With link, 'reflink' or
+            'hardlink', destinations on the source's filesystem share its
+            data rather than get a copy, if they can; see copier.link_file.
+            source, a copier.SharedSource, shares reading the source with
+            copies of it to other devices going on at the same time.
+            With partial, a destination shorter than the source that reads
+            the same as far as it goes, left by an import that stopped
+            part way, is carried on from where it got to.  Copies that
+            don't get finished are removed, whatever stops them.
+            Returns a list of booleans, one per destination, saying which got copied.
+        """
+        from copier import SpaceLedger
+        from dest_index import DestIndex
+        if ledger is None:
+            ledger = SpaceLedger()
+        if index is None:
+            index = DestIndex()
+        copied = [False] * len(dest_dirs)
+        pending = []
+        # Where each partial copy got to
+        partials = {}
+        for (idx, dest_dir) in enumerate(dest_dirs):
+            if not index.isdir(dest_dir):
+                if visitor:
+                    visitor("mkdir", (self, dest_dir))
+                if not dry_run:
+                    try:
+                        os.makedirs(dest_dir)
+                    except OSError:
+                        # Another copy may have beaten us to it
+                        if not os.path.isdir(dest_dir):
+                            raise
+                    index.made_dir(dest_dir)
+            elif visitor:
+                visitor("!mkdir", (self, dest_dir))
+            dest = os.path.join(dest_dir, self.fname)
+            # If it's not there TO START WITH, and nothing else is about to
+            # be copied there under the same name
+            claimed = index.claim(dest_dir, self.fname)
+            if not claimed and partial and not dry_run:
+                got_to = self.__copied_part(dest_dir, dest, index, interrupt)
+                if got_to is not None:
+                    partials[idx] = got_to
+            if claimed or idx in partials:
+                if visitor:
+                    visitor("import", (self, dest))
+                if dry_run:
+                    copied[idx] = True
+                else:
+                    pending.append((idx, dest_dir, dest))
+            else:
+                if visitor:
+                    visitor("already", (self, dest))
+                if dry_run:
+                    copied[idx] = True
+        try:
+            self.__copy_pending(pending, partials, copied, visitor, verify, interrupt, ledger, index, sync, link, source)
+        except:
+            # Half a file would look imported next time, so remove it and
+            # give back its name, whether it was interrupted, the card was
+            # pulled or the disk filled up
+            for (idx, dest_dir, dest) in pending:
+                if not copied[idx]:
+                    if os.path.isfile(dest):
                         os.unlink(dest)
-                    # Now check there's enough free space
-                    if src_len >= PathMetadata(dest_dir).get_free_space():
-                        raise UserWarning("Ran out of disk space")
-                    # Attempt the copy
-                    shutil.copy2(self.path, dest)
-                    # Re-get the length
-                    dest_len = dest_md.size(True)
-                    limit += 1
-                copied = True
-        else:
-            if visitor:
-                visitor("already", (self, dest))
-            if dry_run:
-                copied = True
+                    index.removed(dest_dir, self.fname)
+            raise
         return copied
 
+    def __copied_part(self, dest_dir, dest, index, interrupt):
+        # How much of a copy of us dest is, if it's a partial one
+        from copier import first_difference
+        dest_len = index.size(dest_dir, self.fname)
+        src_len = self.size()
+        if dest_len is None or src_len is None or dest_len >= src_len:
+            return None
+        if first_difference(self.path, dest, 0, interrupt) != dest_len:
+            # Something else by the same name
+            return None
+        return dest_len
+
+    def __copy_pending(self, pending, partials, copied, visitor, verify, interrupt, ledger, index, sync, link, source):
+        from copier import fan_out, first_difference, link_file, device_of, Progress
+        src_len = self.size()
+        if link and pending:
+            # Linking takes no time or space, so there's nothing to reserve, report or verify
+            src_dev = device_of(self.path)
+            still_pending = []
+            for (idx, dest_dir, dest) in pending:
+                if idx not in partials and device_of(dest_dir) == src_dev and link_file(self.path, dest, link):
+                    copied[idx] = True
+                    index.added(dest_dir, self.fname, src_len)
+                else:
+                    still_pending.append((idx, dest_dir, dest))
+            pending = still_pending
+        # None of them are there yet, bar what partial copies got to
+        starts = [partials.get(idx, 0) for (idx, dest_dir, dest) in pending]
+        # What every read of the source has to hash to, once there's been one
+        expected = self.full_hexdigest
+        limit = 0
+        while pending:
+            if limit > 10: # completely arbitrary re-try limit
+                raise UserWarning("Failed to copy %s too many times" % (self.path,))
+            # Carry on from where each got to, if there's enough free space
+            reserved = []
+            try:
+                for ((idx, dest_dir, dest), start) in zip(pending, starts):
+                    ledger.reserve(dest_dir, src_len - start)
+                    reserved.append(src_len - start)
+            except UserWarning:
+                for ((idx, dest_dir, dest), size) in zip(pending, reserved):
+                    ledger.settle(dest_dir, size, 0)
+                raise
+            # Attempt the copy, to all of them at once
+            hasher = hashlib.sha1() if verify else None
+            def report(done, total, rate, eta):
+                if visitor:
+                    visitor("progress", (self, (done, total, rate, eta)))
+            lengths = [None] * len(pending)
+            try:
+                fan_out(self.path, [dest for (idx, dest_dir, dest) in pending], list(starts), hasher,
+                        Progress(0, report, interrupt), sync, source)
+                # Anything read again has to come from the source itself
+                source = None
+                # Re-get the lengths
+                lengths = [PathMetadata(dest).size() for (idx, dest_dir, dest) in pending]
+            finally:
+                for ((idx, dest_dir, dest), start, size, dest_len) in zip(pending, starts, reserved, lengths):
+                    ledger.settle(dest_dir, size, 0 if dest_len is None else max(0, dest_len - start))
+            if hasher is not None:
+                if expected is not None and expected != hasher.hexdigest():
+                    # The source didn't read the same as before, and there's
+                    # no telling where, so write these afresh
+                    starts = [0] * len(pending)
+                    limit += 1
+                    continue
+                expected = self.full_hexdigest = hasher.hexdigest()
+            still_pending = []
+            starts = []
+            for ((idx, dest_dir, dest), dest_len) in zip(pending, lengths):
+                if dest_len == src_len and verify:
+                    # Read it back against the source; carry on from where it first went wrong
+                    wrong = first_difference(self.path, dest, 0, interrupt)
+                    if wrong is not None:
+                        dest_len = wrong
+                if dest_len == src_len:
+                    copied[idx] = True
+                    index.added(dest_dir, self.fname, dest_len)
+                else:
+                    still_pending.append((idx, dest_dir, dest))
+                    # It'll be shorter than the source, so carry on from there
+                    starts.append(dest_len if dest_len is not None and dest_len < src_len else 0)
+            pending = still_pending
+            limit += 1
+
 class MediaMetadata(PathMetadata):
     DTO = 'DateTimeOriginal'
     PHOTOS = ['.jpg', '.jpeg']
     VIDEOS = ['.mov', '.3gp', '.mp4']
+    RAWS = ['.cr2', '.crw', '.nef', '.rw2', '.raw', '.arw', '.orf', '.raf', '.pef', '.dng']
+    # Raws are only imported when asked for
     SUFFIXES = PHOTOS + VIDEOS
     TWELVE_NUMBERS = re.compile('^(?P<YY>\d{2})(?P<MM>\d{2})(?P<DD>\d{2})(?P<HH>\d{2})(?P<mm>\d{2})(?P<SS>\d{2})$')
     VIDEO_AND_NUMBERS = re.compile('^Video(?P<MM>\d{2})(?P<DD>\d{2})(?P<HH>\d{2})(?P<mm>\d{2})$')
 
-    def __init__(self, path):
+    def __init__(self, path, cache = None, capture = None):
         super(MediaMetadata, self).__init__(path)
+        self.cache = cache
+        # The other files the same shot made, if there are any
+        self.capture = capture
+        if capture is not None:
+            capture.join(self)
+        if cache is not None and self.is_file:
+            self.size()
+            cache.fill(self, self.stat)
 
     @staticmethod
-    def has_media_suff(fname):
-        return os.path.splitext(fname)[1].lower() in MediaMetadata.SUFFIXES
+    def has_media_suff(fname, raws = False):
+        # Takes a directory entry from idirs too
+        fname = getattr(fname, 'name', fname)
+        suff = os.path.splitext(fname)[1].lower()
+        return suff in MediaMetadata.SUFFIXES or (raws and suff in MediaMetadata.RAWS)
 
     def read_exif(self, stop_at = None):
         if self.exif_tags is None and self.is_file:
+            # Only needed when the quick reader can't cope, so don't pay to load it up front
+            import EXIF
             with open(self.path, "rb") as f:
                 self.exif_tags = EXIF.process_file(f, stop_tag=stop_at)
 
     def dateTimeOriginal(self):
+        # Try the quick way first, it's most of the time spent on each photo
+        if self.is_file:
+            f = self.probe()
+            try:
+                return date_time_original(f)
+            except MalformedExif:
+                pass
+            finally:
+                f.close()
         self.read_exif(stop_at = MediaMetadata.DTO)
         return None if self.exif_tags is None else self.exif_tags.get('EXIF %s' % (MediaMetadata.DTO))
 
+    def creationDate(self):
+        # From the movie's own header, which survives being copied about unlike its mtime
+        if self.is_file:
+            f = self.probe()
+            try:
+                return creation_date(f)
+            except MalformedMovie:
+                pass
+            finally:
+                f.close()
+        return None
+
+    def probe(self):
+        """ The file to read dates from, starting with what digesting it read
+        """
+        return Probe(self.path, self.size(), self.head)
+
+    def shot_date(self):
+        """ When the EXIF says this was shot, or None if it doesn't
+        """
+        dto = self.dateTimeOriginal()
+        if dto:
+            (YY, MM, DD, HH, mm, ss) = string.splitfields(str(dto).replace(' ', ':'), ':')
+            return (int(YY), int(MM), int(DD))
+        return None
+
     def __read_date(self, reload = False):
         if self.is_file and (reload or self.date is None):
-            root = os.path.join(self.dirname, self.basename)
-            suff = self.suffix
-            lsuff = suff.lower()
-            if '.mov' == lsuff and os.path.isfile(root + ".JPG"):
-                suff = '.JPG'
-            if self.is_file:
+            lsuff = self.suffix.lower()
+            self.date = None
+            if self.capture is not None:
+                self.date = self.capture.date()
+            if self.date is None:
                 mdate = self.mdate()
                 if lsuff in MediaMetadata.VIDEOS:
                     m = MediaMetadata.TWELVE_NUMBERS.search(self.basename)
                     if m:
                         self.date = (2000 + int(m.group('YY')), int(m.group('MM')),  int(m.group('DD')))
                     else:
+                        self.date = self.creationDate()
+                    if self.date is None:
                         m = MediaMetadata.VIDEO_AND_NUMBERS.search(self.basename)
                         if m:
                             self.date = (mdate[0], int(m.group('MM')), int(m.group('DD')))
                 else:
-                    dto = self.dateTimeOriginal()
-                    if dto:
-                        (YY, MM, DD, HH, mm, ss) = string.splitfields(str(dto).replace(' ', ':'), ':')
-                        self.date = (int(YY), int(MM), int(DD))
+                    self.date = self.shot_date()
                 if self.date is None:
                     self.date = mdate
 
+    def digest(self, reload = False):
+        cached = self.hexdigest is not None and not reload
+        ret = super(MediaMetadata, self).digest(reload)
+        if self.cache is not None and not cached:
+            self.cache.store(self)
+        return ret
+
+    def full_digest(self, reload = False):
+        cached = self.full_hexdigest is not None and not reload
+        ret = super(MediaMetadata, self).full_digest(reload)
+        if self.cache is not None and not cached:
+            self.cache.store(self)
+        return ret
+
     def get_date(self, reload = False):
+        cached = self.date is not None and not reload
         self.__read_date(reload)
+        # Done with it, and there may be thousands of us waiting to be copied
+        self.head = None
+        if self.cache is not None and not cached:
+            self.cache.store(self)
         return self.date
 
     def kind(self):
@@ -204,7 +453,56 @@ class MediaMetadata(PathMetadata):
             return "photo"
         elif suff in MediaMetadata.VIDEOS:
             return "video"
+        elif suff in MediaMetadata.RAWS:
+            return "raw photo"
         else:
             return "file (!)"
 
+class Capture(object):
+    """ Files in one directory that one press of the shutter made: a video
+        and its still or thumbnail, a JPEG and its raw, the frames of a
+        burst. They share a shot date, read once from whichever of them
+        best knows it
+    """
+    # Most likely to have the EXIF first
+    LEADS = [MediaMetadata.PHOTOS, ['.thm'], MediaMetadata.RAWS]
+
+    def __init__(self, dirname, names):
+        self.dirname = dirname
+        self.names = sorted(names)
+        self.lock = Lock()
+        self.dated = False
+        self.shot = None
+        # name -> MediaMetadata, for those of names being imported
+        self.members = {}
+
+    def join(self, md):
+        with self.lock:
+            self.members[md.fname] = md
+
+    def lead(self):
+        for suffixes in Capture.LEADS:
+            for name in self.names:
+                if os.path.splitext(name)[1].lower() in suffixes:
+                    return os.path.join(self.dirname, name)
+        return None
+
+    def date(self):
+        """ The lead's shot date, or None if it has none or there's no lead.
+            A lead being imported is asked itself, so what the cache or its
+            digest already has of it gets used.
+        """
+        with self.lock:
+            if not self.dated:
+                self.dated = True
+                lead = self.lead()
+                if lead is not None:
+                    md = self.members.get(os.path.basename(lead), None)
+                    if md is None:
+                        # A thumbnail, say, that isn't imported itself
+                        md = MediaMetadata(lead)
+                    # Its date's only there already if the cache had it
+                    self.shot = md.date if md.date is not None else md.shot_date()
+            return self.shot
+
 #vim:sw=4:ts=4
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['PlanEntry', 'ImportPlan']
+
+import os
+import json
+from path_metadata import MediaMetadata
+from idir import capture_root
+
+class PlanEntry(object):
+    """ One file to import: where from, what we know of it, and where to
+    """
+    FIELDS = ('path', 'size', 'date', 'dest_dirs', 'digest', 'legacy_digest', 'full_digest', 'shot')
+
+    def __init__(self, md, date, dest_dirs):
+        self.md = md
+        self.path = md.path
+        self.size = md.size()
+        self.date = tuple(date)
+        self.dest_dirs = list(dest_dirs)
+        self.digest = md.hexdigest
+        self.legacy_digest = md.legacy_hexdigest
+        self.full_digest = md.full_hexdigest
+        # The number of the first entry of the shot this one was made with
+        self.shot = None
+
+    def key(self):
+        # Files from the same shot go next to each other, and so in together
+        (dirname, fname) = os.path.split(self.path)
+        return (self.date, dirname, capture_root(fname), fname)
+
+    def __cmp__(self, other):
+        return cmp(self.key(), other.key())
+
+    def to_dict(self):
+        return dict([(field, getattr(self, field)) for field in PlanEntry.FIELDS])
+
+    @staticmethod
+    def from_dict(d, cache = None):
+        md = MediaMetadata(d['path'], cache)
+        # Trust what was worked out when the plan was made
+        md.date = tuple(d['date'])
+        md.hexdigest = d['digest'] and str(d['digest'])
+        md.legacy_hexdigest = d['legacy_digest'] and str(d['legacy_digest'])
+        md.full_hexdigest = d['full_digest'] and str(d['full_digest'])
+        entry = PlanEntry(md, d['date'], d['dest_dirs'])
+        entry.shot = d.get('shot', None)
+        return entry
+
+class ImportPlan(object):
+    """ Everything an import is going to copy, and where, so it can be
+        saved, or resumed from its journal
+    """
+    VERSION = 1
+
+    def __init__(self, entries = None):
+        self.entries = [] if entries is None else list(entries)
+
+    def sort(self):
+        self.entries.sort()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def shots(self):
+        """ Yields the entries a list at a time, the entries of a shot together
+        """
+        shot = []
+        for entry in self.entries:
+            if shot and (entry.shot is None or entry.shot != shot[0].shot):
+                yield shot
+                shot = []
+            shot.append(entry)
+        if shot:
+            yield shot
+
+    def needs(self):
+        """ (dest_dir, fname, size) for every copy the plan would make
+        """
+        for entry in self.entries:
+            for dest_dir in entry.dest_dirs:
+                yield (dest_dir, entry.md.fname, entry.size)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            json.dump({'version': ImportPlan.VERSION,
+                       'entries': [entry.to_dict() for entry in self.entries]}, f, indent=1)
+
+#vim:sw=4:ts=4
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['Probe']
+
+import os
+from threading import Lock
+
+class Probe(object):
+    """ Reads like the file at path, from its head where it can, which the
+        date readers mostly need nothing past.  The file's only opened for
+        what's beyond; the head grows to take in what's just past it.  How
+        much gets read up front is learnt for each kind of file, by suffix,
+        from how far into their heads the last few were read, up or down.
+    """
+    MIN_SIZE = 16 * 1024
+    MAX_SIZE = 256 * 1024
+    # A video's date is in a box near its start, or else past any head worth reading
+    LIMITS = {'.mov': 64 * 1024, '.mp4': 64 * 1024, '.3gp': 64 * 1024}
+    # Suffix -> how much of a head to read up front
+    sizes = {}
+    lock = Lock()
+
+    def __init__(self, path, size, head = None):
+        self.path = path
+        self.length = size
+        self.head = head or ''
+        self.f = None
+        self.pos = 0
+        self.kind = Probe.kind_of(path)
+        self.limit = Probe.LIMITS.get(self.kind, Probe.MAX_SIZE)
+        # The furthest into the head anything's been read
+        self.reached = 0
+
+    @staticmethod
+    def kind_of(path):
+        return os.path.splitext(path)[1].lower()
+
+    @staticmethod
+    def head_size(path):
+        with Probe.lock:
+            return Probe.sizes.get(Probe.kind_of(path), Probe.MIN_SIZE)
+
+    @staticmethod
+    def read_head(f, path):
+        return f.read(Probe.head_size(path))
+
+    @staticmethod
+    def learn(kind, reached):
+        """ Size heads of kind to take in reached bytes next time, or if
+            that's well short of what they are, half what they are
+        """
+        want = Probe.MIN_SIZE
+        while want < reached:
+            want *= 2
+        want = min(want, Probe.LIMITS.get(kind, Probe.MAX_SIZE))
+        with Probe.lock:
+            size = Probe.sizes.get(kind, Probe.MIN_SIZE)
+            if want > size:
+                Probe.sizes[kind] = want
+            elif want < size // 2:
+                # Shrink slowly, so one file's small EXIF doesn't undo it
+                Probe.sizes[kind] = size // 2
+
+    def __file(self):
+        if self.f is None:
+            self.f = open(self.path, 'rb')
+        return self.f
+
+    def __grow(self, end):
+        # Round up, so a big EXIF block costs a read or two rather than many
+        want = len(self.head) or 1
+        while want < end:
+            want *= 2
+        want = min(want, self.limit, self.length)
+        f = self.__file()
+        f.seek(len(self.head))
+        self.head += f.read(want - len(self.head))
+
+    def seek(self, offset, whence = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n = -1):
+        if n < 0:
+            n = max(0, self.length - self.pos)
+        end = self.pos + n
+        if end <= self.limit:
+            self.reached = max(self.reached, min(end, self.length))
+        if end > len(self.head) and end <= self.limit and len(self.head) < self.length:
+            self.__grow(end)
+        if end <= len(self.head):
+            data = self.head[self.pos:end]
+        else:
+            f = self.__file()
+            f.seek(self.pos)
+            data = f.read(n)
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.reached:
+            Probe.learn(self.kind, self.reached)
+            self.reached = 0
+        self.head = None
+
+#vim:sw=4:ts=4
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['is_rotational', 'filesystem_type', 'DeviceScheduler']
+
+import os
+import stat
+import platform
+from threading import Lock
+from workers import WorkerPool
+from copier import device_of
+
+IS_WINDOWS = (platform.system() == 'Windows')
+
+def is_rotational(dev):
+    """ Whether device dev, an st_dev, is a spinning disk, as far as Linux
+        says; anything else is taken to be flash
+    """
+    if IS_WINDOWS or not isinstance(dev, (int, long)):
+        return False
+    block = '/sys/dev/block/%d:%d' % (os.major(dev), os.minor(dev))
+    # A partition's queue is its disk's
+    for queue in (os.path.join(block, 'queue'), os.path.join(os.path.dirname(os.path.realpath(block)), 'queue')):
+        try:
+            with open(os.path.join(queue, 'rotational')) as f:
+                return f.read().strip() == '1'
+        except IOError:
+            pass
+    return False
+
+def filesystem_type(dev):
+    """ The type of the filesystem on device dev, an st_dev, as Linux's
+        mount table has it, or None if it's not known
+    """
+    if IS_WINDOWS or not isinstance(dev, (int, long)):
+        return None
+    wanted = '%d:%d' % (os.major(dev), os.minor(dev))
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                # id parent major:minor root mountpoint options [optional...] - type source options
+                (mount, sep, fs) = line.partition(' - ')
+                fields = mount.split()
+                if len(fields) > 2 and fields[2] == wanted and fs:
+                    return fs.split()[0]
+    except IOError:
+        pass
+    return None
+
+class DeviceScheduler(object):
+    """ Walks the sources on each device on threads of their own and puts
+        each device's files through the stages on a pool of its own, its
+        cap of them at once: jobs for flash, or one for a spinning disk,
+        unless per_device says otherwise.  A device's files are handed on
+        in the order they're laid out on it, where that can be told.
+    """
+    # Files to gather up and put in inode order before passing them on
+    SORT_WINDOW = 64
+    # Whose inode numbers are made up, and say nothing about where a file is
+    UNORDERED = ['vfat', 'msdos', 'exfat', 'fuseblk', 'ntfs', 'ntfs3']
+
+    def __init__(self, jobs = 1, per_device = None, interrupt = None):
+        self.jobs = max(1, jobs)
+        self.per_device = per_device
+        self.interrupt = interrupt
+        self.lock = Lock()
+        self.caps = {}
+
+    def cap(self, dev):
+        with self.lock:
+            if dev not in self.caps:
+                if self.per_device:
+                    self.caps[dev] = self.per_device
+                else:
+                    # Seeking between files costs a spinning disk more than waiting does
+                    self.caps[dev] = 1 if is_rotational(dev) else self.jobs
+            return self.caps[dev]
+
+    def by_device(self, dirs, files):
+        """ [(dev, dirs, files)] with dirs and files grouped by their device
+        """
+        devs = {}
+        for (i, paths) in ((0, dirs), (1, files)):
+            for path in paths:
+                dev = device_of(path)
+                devs.setdefault(dev, ([], []))[i].append(path)
+        return [(dev, ds, fs) for (dev, (ds, fs)) in sorted(devs.items())]
+
+    def in_disk_order(self, shots):
+        """ Yields shots, lists of MediaMetadata, in the inode order of their
+            first files, a window at a time; files made one after another on
+            a quiet disk sit next to each other much as their inodes do
+        """
+        window = []
+        for shot in shots:
+            window.append(shot)
+            if len(window) >= DeviceScheduler.SORT_WINDOW:
+                for shot in self.__sorted(window):
+                    yield shot
+                window = []
+        for shot in self.__sorted(window):
+            yield shot
+
+    def __sorted(self, shots):
+        def inode(shot):
+            md = shot[0]
+            md.size()
+            return 0 if md.stat is None else md.stat[stat.ST_INO]
+        return sorted(shots, key=inode)
+
+    def walk(self, dirs, files, find, stages):
+        """ Yields what comes of each device's share of dirs and files, every
+            device at once: find(dirs, files) gives its shots, and each of
+            stages, a function of a WorkerPool and a stream of them, gives
+            the stream the next takes, on the device's own pool
+        """
+        streams = []
+        for (dev, ds, fs) in self.by_device(dirs, files):
+            shots = find(ds, fs)
+            if filesystem_type(dev) not in DeviceScheduler.UNORDERED:
+                shots = self.in_disk_order(shots)
+            pool = WorkerPool(self.cap(dev), self.interrupt)
+            for stage in stages:
+                shots = stage(pool, shots)
+            streams.append(shots)
+        return WorkerPool(1, self.interrupt).merge(streams)
+
+#vim:sw=4:ts=4
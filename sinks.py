@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['SinkClosed', 'ConsoleSink']
+
+import sys
+from threading import Lock
+
+class SinkClosed(Exception):
+    """ Raised by a sink when there's no one left to tell, so the import
+        may as well stop
+    """
+
+class ConsoleSink(object):
+    """ Where an Importer's messages go when there's no window: a stream,
+        stdout by default. Like frame's WindowSink it has logger(s), and
+        twiddle(mode), which spins a cursor only if the stream is a terminal
+    """
+    TWIDDLES = '|/-\\'
+
+    def __init__(self, stream = None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.lock = Lock()
+        self.spinner = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.twiddling = False
+        self.twiddle_next = 0
+
+    def __write(self, s):
+        try:
+            self.stream.write(s)
+            self.stream.flush()
+        except IOError:
+            # Piped into something that's gone away
+            raise SinkClosed()
+
+    def logger(self, s):
+        with self.lock:
+            if self.twiddling:
+                self.__write("\b%s\n%s" % (s, ConsoleSink.TWIDDLES[self.twiddle_next]))
+            else:
+                self.__write("%s\n" % (s,))
+
+    def twiddle(self, mode):
+        # Mode (0, 1, 2) == (start (add first twiddle), advance, erase)
+        if not self.spinner:
+            return
+        with self.lock:
+            if mode == 0:
+                self.twiddle_next = 0
+                self.__write(ConsoleSink.TWIDDLES[self.twiddle_next])
+            elif mode == 1 and self.twiddling:
+                self.twiddle_next = (self.twiddle_next + 1) % len(ConsoleSink.TWIDDLES)
+                self.__write("\b%s" % (ConsoleSink.TWIDDLES[self.twiddle_next],))
+            elif mode == 2 and self.twiddling:
+                self.__write("\b \b")
+            self.twiddling = mode != 2 and (mode == 0 or self.twiddling)
+
+#vim:sw=4:ts=4
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+from __future__ import with_statement
+
+__init__ = ['Stats']
+
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+class Stats(object):
+    """ Counters, and timers for each phase of an import.
+        Phases overlap and run on several threads at once, so a phase's
+        time is the sum of time spent in it by every thread, not wall time.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds, calls = 1):
+        with self.lock:
+            (total, n) = self.timers.get(phase, (0.0, 0))
+            self.timers[phase] = (total + seconds, n + calls)
+
+    @contextmanager
+    def timing(self, phase):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - started)
+
+    def timed(self, phase, func):
+        def timed_func(*args, **kwargs):
+            with self.timing(phase):
+                return func(*args, **kwargs)
+        return timed_func
+
+    def timed_iter(self, phase, iterable):
+        """ Yields what iterable does, timing how long each one took to come
+        """
+        it = iter(iterable)
+        while True:
+            started = time.time()
+            try:
+                item = it.next()
+            except StopIteration:
+                self.add_time(phase, time.time() - started, 0)
+                return
+            self.add_time(phase, time.time() - started)
+            yield item
+
+    def report(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            phases = {}
+            for (phase, (seconds, calls)) in self.timers.items():
+                phases[phase] = {'seconds': seconds, 'calls': calls}
+            return {'elapsed': elapsed,
+                    'phases': phases,
+                    'counters': dict(self.counters)}
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
+
+#vim:sw=4:ts=4
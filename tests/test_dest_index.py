@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of DestIndex: claiming names for copies, and giving them back
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dest_index import DestIndex
+
+class DestIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'IMG_0001.JPG'), 'wb') as f:
+            f.write('x' * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_only_one_claim_wins(self):
+        index = DestIndex()
+        won = []
+        def claim():
+            won.append(index.claim(self.dir, 'IMG_0002.JPG'))
+        threads = [Thread(target=claim) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(won.count(True), 1)
+
+    def test_what_is_there_already_cant_be_claimed(self):
+        self.assertFalse(DestIndex().claim(self.dir, 'IMG_0001.JPG'))
+
+    def test_claim_in_a_directory_still_to_be_made(self):
+        index = DestIndex()
+        missing = os.path.join(self.dir, 'missing')
+        self.assertTrue(index.claim(missing, 'IMG_0001.JPG'))
+        self.assertFalse(index.claim(missing, 'IMG_0001.JPG'))
+
+    def test_given_back(self):
+        index = DestIndex()
+        self.assertTrue(index.claim(self.dir, 'IMG_0002.JPG'))
+        index.removed(self.dir, 'IMG_0002.JPG')
+        self.assertFalse(index.exists(self.dir, 'IMG_0002.JPG'))
+        self.assertTrue(index.claim(self.dir, 'IMG_0002.JPG'))
+
+    def test_no_size_while_being_copied(self):
+        index = DestIndex()
+        self.assertEqual(index.size(self.dir, 'IMG_0001.JPG'), 10)
+        index.claim(self.dir, 'IMG_0002.JPG')
+        self.assertEqual(index.size(self.dir, 'IMG_0002.JPG'), None)
+        index.added(self.dir, 'IMG_0002.JPG', 20)
+        self.assertEqual(index.size(self.dir, 'IMG_0002.JPG'), 20)
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of the digest index: its file format, Bloom filter and merge
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from digest_index import DigestIndex
+
+def digest(n):
+    return hashlib.sha1(str(n)).digest()
+
+class MergeTest(unittest.TestCase):
+
+    def test_union_is_sorted_and_unique(self):
+        old = sorted([digest(n) for n in range(0, 20, 2)])
+        added = sorted([digest(n) for n in range(0, 20, 3)])
+        merged = list(DigestIndex.merge(old, added, set()))
+        self.assertEqual(merged, sorted(set(old) | set(added)))
+
+    def test_removed_are_left_out_of_both(self):
+        old = sorted([digest(n) for n in range(10)])
+        added = sorted([digest(n) for n in range(10, 15)])
+        removed = set([digest(3), digest(12), digest(99)])
+        merged = list(DigestIndex.merge(old, added, removed))
+        self.assertEqual(merged, sorted((set(old) | set(added)) - removed))
+
+    def test_either_side_empty(self):
+        some = sorted([digest(n) for n in range(5)])
+        self.assertEqual(list(DigestIndex.merge([], some, set())), some)
+        self.assertEqual(list(DigestIndex.merge(some, [], set())), some)
+        self.assertEqual(list(DigestIndex.merge([], [], set())), [])
+
+    def test_added_after_the_last_old_one(self):
+        old = sorted([digest(n) for n in range(5)])
+        later = ['\xff' * DigestIndex.DIGEST_SIZE]
+        self.assertEqual(list(DigestIndex.merge(old, later, set())), old + later)
+
+class IndexFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        digests = sorted([digest(n) for n in range(1000)])
+        DigestIndex.write(self.path, iter(digests), len(digests))
+        index = DigestIndex(self.path)
+        try:
+            self.assertEqual(len(index), 1000)
+            self.assertEqual(list(index), digests)
+            for d in digests:
+                self.assertTrue(d in index)
+            for n in range(1000, 2000):
+                self.assertFalse(digest(n) in index)
+        finally:
+            index.close()
+
+    def test_capacity_beyond_what_was_written(self):
+        # Merging sizes the filter for everything that might have been there
+        digests = sorted([digest(n) for n in range(10)])
+        DigestIndex.write(self.path, digests, 100)
+        index = DigestIndex(self.path)
+        try:
+            self.assertEqual(len(index), 10)
+            self.assertTrue(digests[-1] in index)
+        finally:
+            index.close()
+
+    def test_empty(self):
+        DigestIndex.write(self.path, [], 0)
+        index = DigestIndex(self.path)
+        try:
+            self.assertEqual(len(index), 0)
+            self.assertFalse(digest(0) in index)
+        finally:
+            index.close()
+
+    def test_no_file_is_empty(self):
+        index = DigestIndex(self.path)
+        self.assertEqual(len(index), 0)
+        self.assertFalse(digest(0) in index)
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as f:
+            f.write('not an index at all, just some bytes')
+        self.assertRaises(ValueError, DigestIndex, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of the quick DateTimeOriginal reader, on good JPEGs and bad
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import struct
+import unittest
+from cStringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'benchmarks'))
+
+from exif_date import date_time_original, MalformedExif
+from corpus import exif_jpeg
+
+WHEN = time.strptime('2012:03:12 10:11:12', '%Y:%m:%d %H:%M:%S')
+
+def read(data):
+    return date_time_original(StringIO(data))
+
+class ExifDateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jpeg = exif_jpeg(WHEN, 'scan data')
+
+    def test_date_time_original(self):
+        self.assertEqual(read(self.jpeg), '2012:03:12 10:11:12')
+
+    def test_after_a_jfif_app0(self):
+        app0 = '\xff\xe0' + struct.pack('>H', 16) + 'JFIF\x00' + '\x00' * 9
+        self.assertEqual(read(self.jpeg[:2] + app0 + self.jpeg[2:]), '2012:03:12 10:11:12')
+
+    def test_no_exif(self):
+        self.assertEqual(read('\xff\xd8' + '\xff\xda' + struct.pack('>H', 2) + 'scan' + '\xff\xd9'), None)
+
+    def test_not_a_jpeg(self):
+        self.assertRaises(MalformedExif, read, 'GIF89a' + '\x00' * 20)
+        self.assertRaises(MalformedExif, read, '')
+
+    def test_every_truncation(self):
+        # However much of it there is, it's either a date, nothing, or MalformedExif
+        for n in range(len(self.jpeg)):
+            try:
+                got = read(self.jpeg[:n])
+            except MalformedExif:
+                continue
+            self.assertTrue(got is None or got == '2012:03:12 10:11:12', (n, got))
+
+    def test_lost_marker_sync(self):
+        self.assertRaises(MalformedExif, read, '\xff\xd8' + '\x00\xe1\x00\x10' + '\x00' * 16)
+
+    def test_bad_byte_order(self):
+        at = self.jpeg.index('II*\x00')
+        self.assertRaises(MalformedExif, read, self.jpeg[:at] + 'XX' + self.jpeg[at + 2:])
+
+    def test_bad_tiff_magic(self):
+        at = self.jpeg.index('II*\x00')
+        self.assertRaises(MalformedExif, read, self.jpeg[:at + 2] + '\x2b\x00' + self.jpeg[at + 4:])
+
+    def test_implausible_entry_count(self):
+        at = self.jpeg.index('II*\x00') + 8
+        self.assertRaises(MalformedExif, read, self.jpeg[:at] + struct.pack('<H', 0xffff) + self.jpeg[at + 2:])
+
+    def test_ifd_pointing_past_the_end(self):
+        at = self.jpeg.index('II*\x00') + 4
+        self.assertRaises(MalformedExif, read, self.jpeg[:at] + struct.pack('<I', 0x7fffffff) + self.jpeg[at + 4:])
+
+    def test_date_of_the_wrong_type(self):
+        entry = struct.pack('<HH', 0x9003, 2)
+        at = self.jpeg.index(entry)
+        self.assertRaises(MalformedExif, read, self.jpeg[:at] + struct.pack('<HH', 0x9003, 4) + self.jpeg[at + 4:])
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of ImportJournal: one per import, and resuming one that stopped
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import ImportJournal
+from path_metadata import MediaMetadata
+from plan import PlanEntry
+
+class ImportJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base = os.path.join(self.dir, '.import_journal')
+        self.entries = []
+        for n in range(4):
+            path = os.path.join(self.dir, 'IMG_%04d.JPG' % (n,))
+            with open(path, 'wb') as f:
+                f.write('x' * (n + 1))
+            self.entries.append(PlanEntry(MediaMetadata(path), (2012, 3, 12), [os.path.join(self.dir, 'dest')]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def stopped(self):
+        # An import that got half way, then died
+        journal = ImportJournal(self.base)
+        journal.start()
+        journal.add(self.entries[:2])
+        journal.add(self.entries[2:])
+        journal.done(self.entries[:2])
+        journal.close()
+        journal.held.release()
+        return journal
+
+    def test_resumes_what_wasnt_done(self):
+        self.stopped()
+        journal = ImportJournal(self.base)
+        self.assertTrue(journal.resume())
+        (plan, finished) = journal.pending()
+        self.assertEqual(finished, 2)
+        self.assertEqual([entry.path for entry in plan], [entry.path for entry in self.entries[2:]])
+        self.assertEqual([len(shot) for shot in plan.shots()], [2])
+        journal.finish()
+        self.assertEqual(glob.glob(self.base + '*'), [])
+        self.assertFalse(ImportJournal(self.base).resume())
+
+    def test_imports_keep_to_their_own(self):
+        stopped = self.stopped()
+        running = ImportJournal(self.base)
+        running.start()
+        self.assertNotEqual(running.path, stopped.path)
+        running.finish()
+        self.assertTrue(ImportJournal(self.base).resume())
+
+    def test_one_still_running_isnt_resumed(self):
+        running = ImportJournal(self.base)
+        running.start()
+        running.add(self.entries)
+        self.assertFalse(ImportJournal(self.base).resume())
+        running.finish()
+
+    def test_nothing_to_resume(self):
+        self.assertFalse(ImportJournal(self.base).resume())
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
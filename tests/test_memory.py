@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of Memory: remembering, forgetting, and what survives being
+    reopened, its journal being replayed and compacted, and upgrades
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+import cPickle as pickle
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory import Memory
+
+def hexdigest(n):
+    return hashlib.sha1(str(n)).hexdigest()
+
+class MemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '.already_imported')
+        self.compact_at = Memory.COMPACT_AT
+
+    def tearDown(self):
+        Memory.COMPACT_AT = self.compact_at
+        shutil.rmtree(self.dir)
+
+    def memory(self):
+        return Memory(None, self.path)
+
+    def test_remembered_after_reopening(self):
+        memory = self.memory()
+        for n in range(10):
+            memory.remember(hexdigest(n))
+        memory.forget(hexdigest(4))
+        memory.commit()
+        memory = self.memory()
+        for n in range(10):
+            self.assertEqual(memory.known(hexdigest(n)), n != 4)
+        self.assertFalse(memory.known(hexdigest(10)))
+
+    def test_uncommitted_are_lost(self):
+        memory = self.memory()
+        with memory.batch():
+            memory.remember(hexdigest(1))
+        memory.remember(hexdigest(2))
+        self.assertTrue(self.memory().known(hexdigest(1)))
+        self.assertFalse(self.memory().known(hexdigest(2)))
+
+    def test_forgetting_the_unknown(self):
+        self.assertRaises(KeyError, self.memory().forget, hexdigest(1))
+
+    def test_reopened_after_compaction(self):
+        Memory.COMPACT_AT = 8
+        memory = self.memory()
+        for n in range(5):
+            memory.remember(hexdigest(n))
+        memory.commit()
+        memory.forget(hexdigest(2))
+        for n in range(5, 12):
+            memory.remember(hexdigest(n))
+        memory.commit()
+        # Everything's been folded into the index
+        self.assertEqual(os.path.getsize(self.path + '.journal'), 0)
+        self.assertTrue(os.path.isfile(self.path + '.idx'))
+        for m in (memory, self.memory()):
+            for n in range(12):
+                self.assertEqual(m.known(hexdigest(n)), n != 2)
+        # And it carries on from there
+        memory = self.memory()
+        memory.forget(hexdigest(7))
+        memory.remember(hexdigest(2))
+        memory.commit()
+        memory = self.memory()
+        for n in range(12):
+            self.assertEqual(memory.known(hexdigest(n)), n != 7)
+
+    def test_compaction_keeps_what_another_importer_added(self):
+        Memory.COMPACT_AT = 8
+        ours = self.memory()
+        theirs = self.memory()
+        theirs.remember(hexdigest(100))
+        theirs.commit()
+        for n in range(10):
+            ours.remember(hexdigest(n))
+        ours.commit()
+        self.assertEqual(os.path.getsize(self.path + '.journal'), 0)
+        self.assertTrue(self.memory().known(hexdigest(100)))
+
+    def test_torn_journal_line_is_skipped(self):
+        memory = self.memory()
+        memory.remember(hexdigest(1))
+        memory.commit()
+        with open(self.path + '.journal', 'ab') as f:
+            f.write('+' + hexdigest(2)[:17])
+        memory = self.memory()
+        self.assertTrue(memory.known(hexdigest(1)))
+        self.assertFalse(memory.known(hexdigest(2)))
+
+    def test_ambiguous(self):
+        memory = self.memory()
+        memory.remember(hexdigest(1))
+        memory.mark_ambiguous(hexdigest(1))
+        memory.commit()
+        memory = self.memory()
+        self.assertTrue(memory.ambiguous(hexdigest(1)))
+        self.assertFalse(memory.ambiguous(hexdigest(2)))
+
+    def test_migrated_from_the_pickle(self):
+        with open(self.path, 'wb') as f:
+            pickle.dump([Memory.VERSION, set([hexdigest(1), hexdigest(2)])], f)
+        memory = self.memory()
+        self.assertTrue(memory.known(hexdigest(1)))
+        self.assertTrue(memory.known(hexdigest(2)))
+        self.assertFalse(memory.known(hexdigest(3)))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.isfile(self.path + '.old'))
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+""" Behaviour of the movie header's creation date reader, on good movies
+    and bad
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import time
+import struct
+import unittest
+from cStringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, os.path.join(os.path.dirname(here), 'benchmarks'))
+
+from movie_date import creation_date, MalformedMovie, EPOCH_1904
+from corpus import atom, quicktime
+
+WHEN = time.strptime('2012:03:12 10:11:12', '%Y:%m:%d %H:%M:%S')
+
+def read(data):
+    return creation_date(StringIO(data))
+
+def movie(mvhd):
+    return atom('ftyp', 'qt  \0\0\0\0') + atom('mdat', 'media') + atom('moov', atom('mvhd', mvhd))
+
+class MovieDateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = int(time.mktime(WHEN)) + EPOCH_1904
+
+    def test_creation_date(self):
+        self.assertEqual(read(quicktime(WHEN, 'media')), (2012, 3, 12))
+
+    def test_version_1(self):
+        self.assertEqual(read(movie(struct.pack('>B3xQQ', 1, self.created, self.created))), (2012, 3, 12))
+
+    def test_64_bit_atom_size(self):
+        mdat = struct.pack('>I4sQ', 1, 'mdat', 16 + 5) + 'media'
+        mvhd = atom('mvhd', struct.pack('>B3xII', 0, self.created, self.created))
+        self.assertEqual(read(mdat + atom('moov', mvhd)), (2012, 3, 12))
+
+    def test_unset(self):
+        self.assertEqual(read(movie(struct.pack('>B3xII', 0, 0, 0))), None)
+
+    def test_no_moov(self):
+        self.assertEqual(read(atom('ftyp', 'qt  ') + atom('mdat', 'media')), None)
+        self.assertEqual(read(''), None)
+
+    def test_no_mvhd(self):
+        self.assertEqual(read(atom('moov', atom('trak', 'track'))), None)
+
+    def test_unknown_version(self):
+        self.assertRaises(MalformedMovie, read, movie(struct.pack('>B3xII', 7, self.created, self.created)))
+
+    def test_atom_too_small(self):
+        self.assertRaises(MalformedMovie, read, struct.pack('>I4s', 4, 'mdat') + atom('moov', ''))
+        self.assertRaises(MalformedMovie, read, struct.pack('>I4sQ', 1, 'mdat', 8) + atom('moov', ''))
+
+    def test_silly_creation_time(self):
+        self.assertRaises(MalformedMovie, read, movie(struct.pack('>B3xQQ', 1, 2 ** 63, 2 ** 63)))
+
+    def test_every_truncation(self):
+        # However much of it there is, it's either the date, nothing, or MalformedMovie
+        data = quicktime(WHEN, 'media')
+        for n in range(len(data)):
+            try:
+                got = read(data[:n])
+            except MalformedMovie:
+                continue
+            self.assertTrue(got is None or got == (2012, 3, 12), (n, got))
+
+if __name__ == '__main__':
+    unittest.main()
+
+#vim:sw=4:ts=4
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['Inotify', 'MountTable', 'Watcher']
+
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import platform
+from idir import compare, capture_root
+from path_metadata import MediaMetadata
+
+class Inotify(object):
+    """ Just enough of Linux's inotify, through libc
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    # struct inotify_event, before its name
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            self.__raise()
+
+    @staticmethod
+    def available():
+        if platform.system() != 'Linux':
+            return False
+        try:
+            return hasattr(ctypes.CDLL(ctypes.util.find_library('c')), 'inotify_init')
+        except OSError:
+            return False
+
+    def __raise(self, path = None):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self.__raise(path)
+        return wd
+
+    def read(self, timeout):
+        """ [(watch descriptor, mask, name)] of what's happened, waiting
+            up to timeout seconds for something to
+        """
+        (readable, w, x) = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        buf = os.read(self.fd, 64 * 1024)
+        events = []
+        pos = 0
+        while pos + Inotify.EVENT.size <= len(buf):
+            (wd, mask, cookie, n) = Inotify.EVENT.unpack_from(buf, pos)
+            pos += Inotify.EVENT.size
+            events.append((wd, mask, buf[pos:pos + n].rstrip('\0')))
+            pos += n
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class MountTable(object):
+    """ What Linux has mounted where, which says when it's changed
+    """
+    PATH = '/proc/self/mountinfo'
+
+    def __init__(self):
+        self.f = open(MountTable.PATH)
+        # A mount or unmount shows as an exceptional condition on the table
+        self.poll = select.poll()
+        self.poll.register(self.f.fileno(), select.POLLPRI | select.POLLERR)
+        self.mounts = self.__read()
+
+    @staticmethod
+    def available():
+        return platform.system() == 'Linux' and hasattr(select, 'poll') and os.path.isfile(MountTable.PATH)
+
+    def __read(self):
+        self.f.seek(0)
+        mounts = set()
+        for line in self.f.read().splitlines():
+            fields = line.split()
+            if len(fields) > 4:
+                # Spaces and the like in it are octal escapes
+                mounts.add(fields[4].decode('string_escape'))
+        return mounts
+
+    def added(self):
+        """ Where anything's been mounted since last time, without waiting
+        """
+        if not self.poll.poll(0):
+            return []
+        mounts = self.__read()
+        added = sorted(mounts - self.mounts)
+        self.mounts = mounts
+        return added
+
+    def close(self):
+        self.f.close()
+
+class Watcher(object):
+    """ Watches source directories for media turning up or changing, and
+        hands each lot on once it's been left alone for settle seconds, so
+        files still being written aren't imported half done, and once the
+        rest of its shot has too.  Uses inotify where there is one, along
+        with the mount table for cards mounted under the roots, and
+        otherwise looks every POLL seconds.
+    """
+    SETTLE = 2.0
+    POLL = 5.0
+    # Longest to wait for inotify before checking what's settled, or for an interrupt
+    TICK = 0.5
+    MASK = Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_CREATE
+
+    def __init__(self, roots, skip_dirs, interrupt, settle = None, raws = False):
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.skip_dirs = skip_dirs
+        self.raws = raws
+        self.interrupt = interrupt
+        self.settle = Watcher.SETTLE if settle is None else settle
+        # path -> when it last changed
+        self.pending = {}
+        # watch descriptor -> directory
+        self.dirs = {}
+        self.snapshot = {}
+        self.inotify = Inotify() if Inotify.available() else None
+        self.mounts = None
+        if self.inotify is not None:
+            if MountTable.available():
+                self.mounts = MountTable()
+            for root in self.roots:
+                self.__watch_tree(root, False)
+        else:
+            self.snapshot = self.__scan()
+
+    def __skipped(self, name):
+        for skip in self.skip_dirs:
+            if compare(name, skip):
+                return True
+        return False
+
+    def __walk(self, top):
+        for (dirpath, dirnames, filenames) in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not self.__skipped(d)]
+            yield (dirpath, filenames)
+
+    def __touched(self, path):
+        # Every file, so a shot's thumbnail or still holds its video back too
+        self.pending[path] = time.time()
+
+    def __under_roots(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+    def __watch_tree(self, top, found):
+        for (dirpath, filenames) in self.__walk(top):
+            try:
+                self.dirs[self.inotify.add_watch(dirpath, Watcher.MASK)] = dirpath
+            except OSError:
+                # Gone already, or we can't read it
+                continue
+            if found:
+                # A new directory, such as a card being mounted, may have filled before we watched it
+                for fname in filenames:
+                    self.__touched(os.path.join(dirpath, fname))
+
+    def __scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for (dirpath, filenames) in self.__walk(root):
+                for fname in filenames:
+                    path = os.path.join(dirpath, fname)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_size, st.st_mtime)
+        return snapshot
+
+    def __gather(self):
+        """ Note what's changed since last time; False if we've lost track
+        """
+        if self.inotify is None:
+            self.interrupt.wait(Watcher.POLL)
+            snapshot = self.__scan()
+            for (path, signature) in snapshot.items():
+                if self.snapshot.get(path, None) != signature:
+                    self.__touched(path)
+            self.snapshot = snapshot
+            return True
+        if self.mounts is not None:
+            for mountpoint in self.mounts.added():
+                # A watch on the directory it's mounted on sees nothing of what's on it
+                if self.__under_roots(mountpoint):
+                    self.__watch_tree(mountpoint, True)
+        for (wd, mask, name) in self.inotify.read(Watcher.TICK):
+            if mask & Inotify.IN_Q_OVERFLOW:
+                return False
+            if mask & Inotify.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            dirpath = self.dirs.get(wd, None)
+            if dirpath is None or not name:
+                continue
+            path = os.path.join(dirpath, name)
+            if mask & Inotify.IN_ISDIR:
+                if not self.__skipped(name):
+                    self.__watch_tree(path, True)
+            else:
+                self.__touched(path)
+        return True
+
+    def batches(self):
+        """ Yields lists of files that have settled, or the roots themselves
+            if too much happened at once to keep track of, until interrupted
+        """
+        while not self.interrupt.is_set():
+            if not self.__gather():
+                self.pending = {}
+                yield list(self.roots)
+                continue
+            now = time.time()
+            # A shot's files go in together, so wait for all of them to settle
+            unsettled = set([self.__shot_of(path) for (path, changed) in self.pending.items() if now - changed < self.settle])
+            ready = [path for (path, changed) in self.pending.items()
+                     if now - changed >= self.settle and self.__shot_of(path) not in unsettled]
+            for path in ready:
+                del self.pending[path]
+            ready = [path for path in ready if MediaMetadata.has_media_suff(path, self.raws) and os.path.isfile(path)]
+            if ready:
+                yield self.__with_siblings(ready)
+
+    def __shot_of(self, path):
+        (dirpath, fname) = os.path.split(path)
+        return (dirpath, capture_root(fname))
+
+    def __with_siblings(self, paths):
+        """ paths, and whatever else is in their directories from the same
+            shots, such as a thumbnail or a still imported before, to date them by
+        """
+        shots = set([self.__shot_of(path) for path in paths])
+        batch = set(paths)
+        for dirpath in set([dirpath for (dirpath, root) in shots]):
+            try:
+                names = os.listdir(dirpath)
+            except OSError:
+                continue
+            for fname in names:
+                path = os.path.join(dirpath, fname)
+                if (dirpath, capture_root(fname)) in shots and os.path.isfile(path):
+                    batch.add(path)
+        return sorted(batch)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        if self.mounts is not None:
+            self.mounts.close()
+            self.mounts = None
+
+#vim:sw=4:ts=4
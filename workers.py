@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+#Copyright (c) 2011 Norman Craig Emery
+#
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+#
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+
+__init__ = ['WorkerPool']
+
+import sys
+from threading import Thread, Event, Semaphore
+from Queue import Queue, Empty, Full
+
+def close_iterable(iterable):
+    # Closing a generator runs its finally clauses, which stop its own threads
+    close = getattr(iterable, 'close', None)
+    if close is not None:
+        close()
+
+class WorkerPool(object):
+    """ A small pool of daemon threads mapping a function over an iterable.
+        Results come back in completion order, as (item, result) pairs.
+    """
+    POLL = 0.25
+
+    def __init__(self, workers = 1, interrupt = None, depth = None):
+        self.workers = max(1, workers)
+        self.interrupt = interrupt if interrupt is not None else Event()
+        self.depth = depth if depth else self.workers * 4
+
+    def __stopping(self, stop):
+        return stop.is_set() or self.interrupt.is_set()
+
+    def __put(self, q, item, stop):
+        # Bounded put that gives up when asked to stop
+        while not self.__stopping(stop):
+            try:
+                q.put(item, True, WorkerPool.POLL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def __get(self, q, stop):
+        while not self.__stopping(stop):
+            try:
+                return (True, q.get(True, WorkerPool.POLL))
+            except Empty:
+                pass
+        return (False, None)
+
+    def imap_unordered(self, func, iterable):
+        if self.workers == 1:
+            # No point paying for threads
+            try:
+                for item in iterable:
+                    if self.interrupt.is_set():
+                        return
+                    yield (item, func(item))
+            finally:
+                close_iterable(iterable)
+            return
+
+        stop = Event()
+        todo = Queue(self.depth)
+        done = Queue(self.depth)
+        end = object()
+
+        def feeder():
+            try:
+                for item in iterable:
+                    if not self.__put(todo, (True, item), stop):
+                        return
+            except Exception:
+                self.__put(done, (end, sys.exc_info()), stop)
+            finally:
+                close_iterable(iterable)
+            for i in range(self.workers):
+                self.__put(todo, (False, None), stop)
+
+        def worker():
+            while True:
+                (got, job) = self.__get(todo, stop)
+                if not got:
+                    return
+                (more, item) = job
+                if not more:
+                    self.__put(done, (end, None), stop)
+                    return
+                try:
+                    self.__put(done, (item, (True, func(item))), stop)
+                except Exception:
+                    self.__put(done, (item, (False, sys.exc_info())), stop)
+
+        threads = [Thread(target=feeder)] + [Thread(target=worker) for i in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            running = self.workers
+            while running > 0:
+                (got, res) = self.__get(done, stop)
+                if not got:
+                    return
+                (item, outcome) = res
+                if item is end:
+                    if outcome is not None:
+                        raise outcome[0], outcome[1], outcome[2]
+                    running -= 1
+                    continue
+                (ok, value) = outcome
+                if not ok:
+                    raise value[0], value[1], value[2]
+                yield (item, value)
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    def imap_by(self, func, iterable, key, limit = None):
+        """ Like imap_unordered, but each key(item) gets a queue and workers
+            of its own, so items for a slow key don't hold up the others'.
+            No more than limit run at once across all the keys.
+        """
+        stop = Event()
+        done = Queue(self.depth)
+        end = object()
+        slots = Semaphore(limit) if limit else None
+        threads = []
+
+        def worker(todo):
+            while True:
+                (got, item) = self.__get(todo, stop)
+                if not got:
+                    return
+                if item is end:
+                    self.__put(done, (end, None), stop)
+                    return
+                if slots is not None:
+                    slots.acquire()
+                try:
+                    try:
+                        self.__put(done, (item, (True, func(item))), stop)
+                    except Exception:
+                        self.__put(done, (item, (False, sys.exc_info())), stop)
+                finally:
+                    if slots is not None:
+                        slots.release()
+
+        def feeder():
+            queues = {}
+            try:
+                try:
+                    for item in iterable:
+                        k = key(item)
+                        todo = queues.get(k, None)
+                        if todo is None:
+                            todo = queues[k] = Queue(self.depth)
+                            for i in range(self.workers):
+                                t = Thread(target=worker, args=(todo,))
+                                t.daemon = True
+                                t.start()
+                                threads.append(t)
+                        if not self.__put(todo, item, stop):
+                            return
+                except Exception:
+                    self.__put(done, (None, (False, sys.exc_info())), stop)
+            finally:
+                close_iterable(iterable)
+            for todo in queues.values():
+                for i in range(self.workers):
+                    self.__put(todo, end, stop)
+            # Tell the consumer how many workers to wait for
+            self.__put(done, (end, len(queues) * self.workers), stop)
+
+        fed = Thread(target=feeder)
+        fed.daemon = True
+        fed.start()
+        try:
+            running = None
+            finished = 0
+            while running is None or finished < running:
+                (got, res) = self.__get(done, stop)
+                if not got:
+                    return
+                (item, outcome) = res
+                if item is end:
+                    if outcome is None:
+                        finished += 1
+                    else:
+                        running = outcome
+                    continue
+                (ok, value) = outcome
+                if not ok:
+                    raise value[0], value[1], value[2]
+                yield (item, value)
+        finally:
+            stop.set()
+            fed.join()
+            for t in threads:
+                t.join()
+
+    def merge(self, iterables):
+        """ Yields what each of iterables does, in whatever order it comes,
+            running each on a thread of its own rather than on the workers
+        """
+        iterables = list(iterables)
+        if len(iterables) == 1:
+            try:
+                for item in iterables[0]:
+                    if self.interrupt.is_set():
+                        return
+                    yield item
+            finally:
+                close_iterable(iterables[0])
+            return
+
+        stop = Event()
+        done = Queue(self.depth)
+        end = object()
+
+        def drain(iterable):
+            try:
+                for item in iterable:
+                    if not self.__put(done, (True, item), stop):
+                        return
+            except Exception:
+                self.__put(done, (False, sys.exc_info()), stop)
+            finally:
+                close_iterable(iterable)
+            self.__put(done, (True, end), stop)
+
+        threads = [Thread(target=drain, args=(iterable,)) for iterable in iterables]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            running = len(threads)
+            while running > 0:
+                (got, res) = self.__get(done, stop)
+                if not got:
+                    return
+                (ok, item) = res
+                if not ok:
+                    raise item[0], item[1], item[2]
+                if item is end:
+                    running -= 1
+                    continue
+                yield item
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+#vim:sw=4:ts=4